@@ -14,3 +14,10 @@ class AbstractAgent(abc.ABC):
     @abc.abstractmethod
     def update(self, payoff, context, user_id):
         pass
+
+    def user_theta(self, user_id):
+        """
+        Current estimate of the user's preferences as a vector in context space, such that theta . context_vector
+        is the expected payoff of a context, or None if the agent has no such estimate
+        """
+        return None
@@ -2,6 +2,10 @@ import abc
 
 
 class AbstractUserContextManager(abc.ABC):
+    # whether every context get_user_and_contexts returns has an id never seen before, so that nothing kept by
+    # context id is ever found again
+    UNIQUE_CONTEXT_IDS = False
+
     @abc.abstractmethod
     def get_user_and_contexts(self):
         pass
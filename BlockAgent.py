@@ -4,7 +4,20 @@ import scipy.sparse as sp_sparse
 from scipy.linalg import fractional_matrix_power
 from numpy.linalg import multi_dot
 import math
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import os
+import tempfile
+from sherman_morrison import rank_one_update, sherman_morrison_update
+from PhiCache import PhiCache, MAX_BYTES as PHI_CACHE_BYTES
+
+
+def cluster_subgraph(graph, users):
+    """
+    Adjacency matrix among users, as a dense matrix, from a dense or scipy sparse graph
+    """
+    if sp_sparse.issparse(graph):
+        return sp_sparse.csr_matrix(graph)[users][:, users].toarray()
+    return np.asarray(graph)[np.ix_(users, users)]
 
 
 class BlockAgent(AbstractAgent):
@@ -16,47 +29,116 @@ class BlockAgent(AbstractAgent):
         """
         Maintains necessary vectors/matrices for each cluster:
         bias, m, m_inverse, a_kron_exp, num_users
+        m and a_kron are never read by the algorithm, and are only kept if keep_full_matrices
         """
-        def __init__(self, vector_size, users, graph):
+        ARRAYS = ["bias", "m_inverse", "a_kron_exp"]
+
+        def __init__(self, vector_size, users, graph, keep_full_matrices=True, dtype=np.float32):
             self.num_users = len(users)
             self.user_to_user_in_cluster = {}
             # create mapping between user_ids and user index in matrix
             for i in range(self.num_users):
                 self.user_to_user_in_cluster[users[i]] = i
             # create graph for this cluster -- new adjacency matrix
-            new_graph = np.zeros((self.num_users, self.num_users))
-            for first_user in users:
-                for second_user in users:
-                    if graph[first_user][second_user] == 1:
-                        new_graph[self.user_to_user_in_cluster[first_user]] \
-                                 [self.user_to_user_in_cluster[second_user]] = 1
-                    else:
-                        new_graph[self.user_to_user_in_cluster[first_user]] \
-                                 [self.user_to_user_in_cluster[second_user]] = 0
+            new_graph = (cluster_subgraph(graph, users) == 1).astype(dtype)
             # initiate necessary vectors/matrices for this cluster
-            self.bias = np.zeros(vector_size * self.num_users, dtype=np.float32)
-            self.m = np.identity(self.num_users * vector_size, dtype=np.float32)
-            i_n = np.identity(self.num_users, dtype=np.float32)
+            self.bias = np.zeros(vector_size * self.num_users, dtype=dtype)
+            i_n = np.identity(self.num_users, dtype=dtype)
             # construct a laplacian matrix based on the graph, that we will modify and then
             # take the kronecker product of to get a representation of the graph that helps us learn
             # although the laplacian is sp_sparse, if called on a dense matrix it will return a dense matrix
             laplacian = sp_sparse.csgraph.laplacian(new_graph)
             a = i_n + laplacian
-            i_d = np.identity(vector_size, dtype=np.float32)
-            self.a_kron = np.kron(a.astype(np.float32), i_d.astype(np.float32))
-            self.a_kron_exp = fractional_matrix_power(self.a_kron, -1 / 2).astype(np.float32)
-            self.m_inverse = np.identity(self.num_users * vector_size, dtype=np.float32)  # inverse of identity is inverse
+            i_d = np.identity(vector_size, dtype=dtype)
+            # (a kron i_d)^(-1/2) is a^(-1/2) kron i_d, so the power is only taken of the num_users x num_users matrix
+            a_exp = np.real(fractional_matrix_power(a, -1 / 2)).astype(dtype)
+            self.a_kron_exp = np.kron(a_exp, i_d)
+            if keep_full_matrices:
+                self.m = np.identity(self.num_users * vector_size, dtype=dtype)
+                self.a_kron = np.kron(a, i_d)
+            else:
+                self.m = None
+                self.a_kron = None
+            self.m_inverse = np.identity(self.num_users * vector_size, dtype=dtype)  # inverse of identity is inverse
+
+        def nbytes(self):
+            return sum(getattr(self, name).nbytes for name in ["bias", "m", "m_inverse", "a_kron", "a_kron_exp"]
+                       if getattr(self, name) is not None)
+
+        def spill(self, prefix):
+            """
+            Writes the arrays to prefix_<name>.npy files and releases them
+            """
+            for name in self.ARRAYS:
+                array = getattr(self, name)
+                path = "{}_{}.npy".format(prefix, name)
+                if isinstance(array, np.memmap) and array.filename == os.path.abspath(path):
+                    # still mapped from the last spill, only the changed pages need writing
+                    array.flush()
+                else:
+                    np.save(path, array)
+                setattr(self, name, None)
 
-    def __init__(self, graph, num_users, cluster_data, vector_size=25, alpha=0.1):
+        def reload(self, prefix):
+            """
+            Maps the arrays back from the files written by spill, pages are read as they are used
+            """
+            for name in self.ARRAYS:
+                setattr(self, name, np.load("{}_{}.npy".format(prefix, name), mmap_mode="r+"))
+
+    def __init__(self, graph, num_users, cluster_data, vector_size=25, alpha=0.1, memory_budget=None, spill_dir=None,
+                 phi_cache_bytes=PHI_CACHE_BYTES, dtype=np.float32):
+        """
+        Cluster state is allocated the first time one of the cluster's users is seen.
+        :param memory_budget: if set, bytes of cluster state kept in memory. The least recently used clusters beyond it
+        are spilled to memory-mapped .npy files in spill_dir (a temporary directory if None), and m and a_kron are
+        not kept.
+        :param phi_cache_bytes: bytes of long phi vectors kept for reuse, see PhiCache
+        :param dtype: dtype of the clusters' matrices, which should be that of the context vectors
+        """
         self.vector_size = vector_size
         self.alpha = alpha
         self.cluster_to_idx, self.idx_to_cluster = cluster_data
-        self.cluster_info = {}
-        for cluster in self.cluster_to_idx.keys():
-            users = self.cluster_to_idx[cluster]
-            self.cluster_info[cluster] = self.ClusterInfo(vector_size, users, graph)
-        self.context_ids_to_phis = {}  # this gets reset with every iteration, but it's good to initialize everything
-        # in the __init__
+        self.graph = graph
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.dtype = dtype
+        # resident clusters, least recently used first
+        self.cluster_info = OrderedDict()
+        self.spilled_cluster_info = {}
+        # long phi vectors by (user_id, context_id), from choose to update and across rounds
+        self.phi_cache = PhiCache(phi_cache_bytes)
+
+    def get_cluster_info(self, cluster):
+        """
+        ClusterInfo of cluster, created or reloaded from disk if it is not in memory
+        """
+        cluster_info = self.cluster_info.get(cluster)
+        if cluster_info is not None:
+            self.cluster_info.move_to_end(cluster)
+            return cluster_info
+        if cluster in self.spilled_cluster_info:
+            cluster_info = self.spilled_cluster_info.pop(cluster)
+            cluster_info.reload(self._spill_prefix(cluster))
+        else:
+            cluster_info = self.ClusterInfo(self.vector_size, self.cluster_to_idx[cluster], self.graph,
+                                            keep_full_matrices=self.memory_budget is None, dtype=self.dtype)
+        self.cluster_info[cluster] = cluster_info
+        if self.memory_budget is not None:
+            # evict least recently used clusters, but always keep the one in use
+            while len(self.cluster_info) > 1 and \
+                    sum(info.nbytes() for info in self.cluster_info.values()) > self.memory_budget:
+                evicted_cluster, evicted_info = self.cluster_info.popitem(last=False)
+                evicted_info.spill(self._spill_prefix(evicted_cluster))
+                self.spilled_cluster_info[evicted_cluster] = evicted_info
+        return cluster_info
+
+    def _spill_prefix(self, cluster):
+        if self.spill_dir is None:
+            # removed when the agent is garbage collected or the interpreter exits
+            self.temporary_spill_dir = tempfile.TemporaryDirectory(prefix="block_agent_")
+            self.spill_dir = self.temporary_spill_dir.name
+        return os.path.join(self.spill_dir, "cluster_{}".format(cluster))
 
     def calculate_score(self, phi, timestep, w_t, cluster):
         """
@@ -64,7 +146,7 @@ class BlockAgent(AbstractAgent):
         will produce, and the ucb, which encodes our confidence that we will gain that payoff and the potential of
         higher payoffs through further exploration
         """
-        m_inverse = self.cluster_info[cluster].m_inverse
+        m_inverse = self.get_cluster_info(cluster).m_inverse
         ucb = self.alpha * np.sqrt(multi_dot([np.transpose(phi), m_inverse, phi]) * math.log(timestep + 1))
         return float(w_t.dot(phi) + ucb)
 
@@ -73,46 +155,54 @@ class BlockAgent(AbstractAgent):
         Chooses best context for user, taking into account exploration, at current timestep.
         """
         cluster = self.idx_to_cluster[user_id]
-        cluster_info = self.cluster_info[cluster]
-        user_id = cluster_info.user_to_user_in_cluster[user_id]
+        cluster_info = self.get_cluster_info(cluster)
         w_t = cluster_info.m_inverse.dot(cluster_info.bias)
         # new_contexts will contain the modified long phi vectors as described in the paper
-        new_contexts = []
-        for context in contexts:
-            context_id, context_vector = context
-            new_context = np.zeros(cluster_info.num_users * self.vector_size, dtype=np.float32)
-            for i in range(self.vector_size):
-                # the context_vector is placed in the new context such that it begins in block indexed by the
-                # current user, this provides a means of identifying to the algorithm which user is currently being
-                # examined. The block begins at user_id * self.vector_size, following which the vector is placed, with
-                # a length vector_size
-                new_context[i + user_id * self.vector_size] = np.float32(context_vector[i])
-            # modify long vector by graph information (self.a_kron_exp) to get encoding that takes into account graph
-            new_contexts.append(np.matmul(cluster_info.a_kron_exp, new_context))
+        new_contexts = [self.get_phi(cluster_info, user_id, context) for context in contexts]
         scores = [self.calculate_score(context, timestep, w_t, cluster) for context in new_contexts]
         max_context_index = np.argmax(scores)
-        # cache long phi vectors from choose to update to avoid recomputation
-        self.context_ids_to_phis = {}
-        for context, phi in zip(contexts, new_contexts):
-            context_id, context_vector = context
-            self.context_ids_to_phis[context_id] = phi
         return contexts[max_context_index]
 
+    def get_phi(self, cluster_info, user_id, context):
+        """
+        Long phi vector of a context for a user, from the cache unless it is not there
+        """
+        context_id, context_vector = context
+        user_in_cluster = cluster_info.user_to_user_in_cluster[user_id]
+        return self.phi_cache.get((user_id, context_id), context_vector,
+                                  lambda: self.transform_context(cluster_info, user_in_cluster, context_vector))
+
+    def transform_context(self, cluster_info, user_in_cluster, context_vector):
+        """
+        Long phi vector of a context for the user at index user_in_cluster of the cluster
+        """
+        # the long vector holds the context_vector in the block indexed by the current user, which identifies to the
+        # algorithm which user is currently being examined, and is zero elsewhere. It is modified by graph information
+        # (a_kron_exp) to get an encoding that takes the graph into account, so only the user's block of columns of
+        # a_kron_exp contributes.
+        block = slice(user_in_cluster * self.vector_size, (user_in_cluster + 1) * self.vector_size)
+        return cluster_info.a_kron_exp[:, block].dot(context_vector)
+
+    def user_theta(self, user_id):
+        """
+        The user's block of the cluster's a_kron_exp (which is symmetric) times w_t, see GOBLinAgent.user_theta
+        """
+        cluster_info = self.get_cluster_info(self.idx_to_cluster[user_id])
+        user_id = cluster_info.user_to_user_in_cluster[user_id]
+        w_t = cluster_info.m_inverse.dot(cluster_info.bias)
+        block = slice(user_id * self.vector_size, (user_id + 1) * self.vector_size)
+        return cluster_info.a_kron_exp[block].dot(w_t)
+
     def update(self, payoff, context, user_id):
         """
         Updates matrices based on payoff of chosen context
         """
         cluster = self.idx_to_cluster[user_id]
-        cluster_info = self.cluster_info[cluster]
-        context_id, context_vector = context
-        # retrieve modified long vector phi associated with the context_id and stored in self.choose
-        phi = self.context_ids_to_phis[context_id]
+        cluster_info = self.get_cluster_info(cluster)
+        # retrieve modified long vector phi, usually computed by self.choose
+        phi = self.get_phi(cluster_info, user_id, context)
         cluster_info.bias = cluster_info.bias + phi * payoff
-        # in order to dot properly, we need this represented as a vector_size*1 matrix, not a vector_size-long vector
-        phi = np.expand_dims(phi, axis=0)
-        phi_transpose = np.transpose(phi)
-        outer_product = np.matmul(phi_transpose, phi)
-        cluster_info.m = cluster_info.m + outer_product
-        # calculates matrix inverse using https://en.wikipedia.org/wiki/Sherman%E2%80%93Morrison_formula
-        numerator = multi_dot([cluster_info.m_inverse, phi_transpose, phi, cluster_info.m_inverse])
-        cluster_info.m_inverse = cluster_info.m_inverse - (numerator / (1 + multi_dot([phi, cluster_info.m_inverse, phi_transpose]).item()))
+        # m + phi phi^T, and its inverse by Sherman-Morrison, both in place
+        if cluster_info.m is not None:
+            rank_one_update(cluster_info.m, phi)
+        sherman_morrison_update(cluster_info.m_inverse, phi)
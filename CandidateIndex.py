@@ -0,0 +1,157 @@
+from AbstractUserContextManager import AbstractUserContextManager
+import numpy as np
+
+
+class ExactCandidateIndex:
+    """
+    Finds the k contexts with the highest theta . x + margin * |x| by scanning the context matrix in blocks,
+    which bounds the memory of the scores to block_size. The margin term is an upper bound on the
+    exploration bonus of a UCB score, which grows with the norm of the context.
+    """
+
+    def __init__(self, vectors, block_size=1 << 16):
+        self.block_size = block_size
+        self.vectors = vectors[:0]
+        # norms in a buffer with spare rows, like the vectors of TaggedUserContextManager
+        self.norm_buffer = np.zeros(len(vectors), dtype=vectors.dtype)
+        self.norms = self.norm_buffer[:0]
+        self.size = 0
+        self.add(vectors)
+
+    def add(self, vectors):
+        """
+        Indexes the contexts appended to the catalogue since the last call
+        :param vectors: vectors of the whole catalogue, of which the first size rows are indexed already
+        """
+        start, end = self.size, len(vectors)
+        if end > len(self.norm_buffer):
+            norm_buffer = np.zeros(max(2 * len(self.norm_buffer), end), dtype=self.norm_buffer.dtype)
+            norm_buffer[:start] = self.norms
+            self.norm_buffer = norm_buffer
+        self.norm_buffer[start:end] = np.linalg.norm(vectors[start:end], axis=1)
+        self.norms = self.norm_buffer[:end]
+        self.vectors = vectors
+        self.size = end
+        return start, end
+
+    def scores(self, indices, theta, margin):
+        return self.vectors[indices] @ theta + margin * self.norms[indices]
+
+    def query(self, theta, k, margin=0.0):
+        """
+        :return: indices of the k best contexts for theta
+        """
+        best = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=self.vectors.dtype)
+        for start in range(0, self.size, self.block_size):
+            end = min(start + self.block_size, self.size)
+            block_scores = self.vectors[start:end] @ theta + margin * self.norms[start:end]
+            # merge the block into the running top k
+            best = np.concatenate([best, np.arange(start, end)])
+            best_scores = np.concatenate([best_scores, block_scores])
+            if len(best) > k:
+                top = np.argpartition(-best_scores, k)[:k]
+                best, best_scores = best[top], best_scores[top]
+        return best
+
+
+class LSHCandidateIndex(ExactCandidateIndex):
+    """
+    Approximate index using random hyperplane locality sensitive hashing. Each of num_tables tables hashes a context
+    to the signs of its projection on num_bits random hyperplanes, so contexts at a small angle to theta tend to share
+    its bucket. A query collects the contexts in theta's buckets (and, while there are fewer than k, in the buckets one
+    bit away), then ranks only those exactly, so its cost depends on bucket sizes instead of the number of contexts.
+    """
+
+    def __init__(self, vectors, num_tables=8, num_bits=10, seed=0):
+        rng = np.random.default_rng(seed)
+        self.num_bits = num_bits
+        self.bit_values = 1 << np.arange(num_bits)
+        self.hyperplanes = rng.standard_normal((num_tables, num_bits, vectors.shape[1])).astype(vectors.dtype)
+        self.tables = [{} for _ in range(num_tables)]
+        super().__init__(vectors)
+
+    def add(self, vectors):
+        start, end = super().add(vectors)
+        for table, hyperplanes in zip(self.tables, self.hyperplanes):
+            codes = self._codes(vectors[start:end], hyperplanes)
+            # new contexts grouped by code, each group appended to the bucket of its code
+            order = np.argsort(codes, kind="stable")
+            unique_codes, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+            for code, group_start, count in zip(unique_codes.tolist(), starts, counts):
+                indices = start + order[group_start:group_start + count]
+                bucket = table.get(code)
+                table[code] = indices if bucket is None else np.concatenate([bucket, indices])
+        return start, end
+
+    def _codes(self, vectors, hyperplanes):
+        return (vectors @ hyperplanes.T > 0) @ self.bit_values
+
+    def query(self, theta, k, margin=0.0):
+        codes = [int(self._codes(theta[np.newaxis], hyperplanes)[0]) for hyperplanes in self.hyperplanes]
+        candidates = [table.get(code, []) for table, code in zip(self.tables, codes)]
+        if sum(len(bucket) for bucket in candidates) < k:
+            # multi-probe the neighbouring buckets
+            candidates += [table.get(code ^ (1 << bit), []) for table, code in zip(self.tables, codes)
+                           for bit in range(self.num_bits)]
+        candidates = np.unique(np.concatenate([np.asarray(bucket, dtype=np.int64) for bucket in candidates]))
+        if len(candidates) <= k:
+            return candidates
+        top = np.argpartition(-self.scores(candidates, theta, margin), k)[:k]
+        return candidates[top]
+
+
+class ShortlistUserContextManager(AbstractUserContextManager):
+    """
+    Offers a user a shortlist of contexts retrieved from the whole catalogue of a TaggedUserContextManager,
+    instead of a random collection. The shortlist holds the num_candidates contexts that score best for the
+    agent's current estimate of the user's preferences (agent.user_theta) plus an exploration margin.
+    Users the agent has no estimate for yet are offered a random shortlist.
+    """
+
+    def __init__(self, user_context_manager, agent, index_type="exact", num_candidates=25, margin=0.1, seed=None):
+        self.user_context_manager = user_context_manager
+        self.agent = agent
+        self.index_type = index_type
+        self.num_candidates = num_candidates
+        self.margin = margin
+        self.index = None
+        self.index_generation = None
+        # Generator.choice samples a few contexts without permuting the whole catalogue
+        self.rng = np.random.default_rng(seed)
+
+    def _current_index(self, vectors, generation):
+        # contexts appended by add_contexts are added to the index, which is only rebuilt when a refit has replaced
+        # the vectors of the contexts it holds
+        if self.index is not None and self.index_generation == generation:
+            if self.index.size < len(vectors):
+                self.index.add(vectors)
+        else:
+            self.index_generation = generation
+            if self.index_type == "exact":
+                self.index = ExactCandidateIndex(vectors)
+            elif self.index_type == "lsh":
+                self.index = LSHCandidateIndex(vectors)
+            else:
+                raise Exception("Candidate index not implemented! Try exact, lsh")
+        return self.index
+
+    def get_user_and_contexts(self):
+        user = self.user_context_manager.get_user()
+        # a refit in the background replaces the contexts and their vectors together, so both are taken under the
+        # lock, and the shortlist indexes the contexts it was retrieved from
+        with self.user_context_manager.lock:
+            contexts = self.user_context_manager.contexts
+            vectors = self.user_context_manager.context_vectors
+            generation = self.user_context_manager.generation
+        index = self._current_index(vectors, generation)
+        theta = self.agent.user_theta(user)
+        indices = []
+        if theta is not None and np.any(theta):
+            indices = index.query(theta.astype(index.vectors.dtype), self.num_candidates, self.margin)
+        if not len(indices):
+            indices = self.rng.choice(index.size, size=min(self.num_candidates, index.size), replace=False)
+        return user, [contexts[i] for i in indices]
+
+    def get_payoff(self, user, context):
+        return self.user_context_manager.get_payoff(user, context)
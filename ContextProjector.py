@@ -0,0 +1,49 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.decomposition import TruncatedSVD
+
+
+class ContextProjector:
+    """
+    Keeps the idf weights of a fitted TF-IDF transformation and the components of a fitted truncated SVD,
+    so that new contexts can be embedded from their tags by a sparse times dense multiply (fold-in)
+    instead of refitting both over every context.
+    """
+
+    def __init__(self, idf, components, dtype=np.float32):
+        # idf has one weight per tag known at fit time, components is num_features x num_tags
+        self.idf = idf.astype(dtype)
+        self.components_transpose = np.ascontiguousarray(components.T, dtype=dtype)
+        self.num_tags = len(idf)
+
+    @classmethod
+    def fit(cls, tag_matrix, num_features=25, svd_iterations=5, dtype=np.float32):
+        """
+        Fits TF-IDF and SVD to a binary context x tag matrix
+        :param dtype: dtype of the embedded contexts, and of the projections of later contexts
+        :return: projector, matrix of the embedded contexts
+        """
+        # value in tag_matrix is decreased corresponding to the number of contexts that are tagged
+        # with a given tag, making it so that rare tags count for more. TFIDF also weights by
+        # the number of times that the tag appears with a given context, but since here all are 1
+        # this is not meaningful
+        transformer = TfidfTransformer()
+        contexts_array = transformer.fit_transform(tag_matrix)
+        # use singular value decomposition to compress our high-dimensional sparse representation of each context
+        # into a num-features-dimensional dense representation. Both steps keep the input sparse.
+        svd = TruncatedSVD(n_components=num_features, algorithm="randomized", n_iter=svd_iterations)
+        svd_contexts = svd.fit_transform(contexts_array).astype(dtype, copy=False)
+        return cls(transformer.idf_, svd.components_, dtype), svd_contexts
+
+    def project(self, tag_matrix):
+        """
+        Embeds the rows of a binary context x tag matrix. Columns beyond the tags known at fit time are ignored.
+        :return: matrix of the embedded contexts, of the projector's dtype
+        """
+        known = tag_matrix[:, :self.num_tags].tocsr().astype(self.idf.dtype)
+        # same weighting as TfidfTransformer: idf per tag, then each row is scaled to unit length
+        known = known.multiply(self.idf).tocsr()
+        norms = np.sqrt(np.asarray(known.multiply(known).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        weighted = known.multiply(1 / norms[:, np.newaxis]).tocsr()
+        return np.asarray(weighted @ self.components_transpose)
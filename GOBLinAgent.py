@@ -4,31 +4,39 @@ import scipy.sparse as sp_sparse
 from scipy.linalg import fractional_matrix_power
 from numpy.linalg import multi_dot
 import math
+from sherman_morrison import rank_one_update, sherman_morrison_update
+from PhiCache import PhiCache, MAX_BYTES as PHI_CACHE_BYTES
 
 
 class GOBLinAgent(AbstractAgent):
     """
     Implementation of GOBLin algorithm
     """
-    def __init__(self, graph, num_users, vector_size=25, alpha=0.1):
+    def __init__(self, graph, num_users, vector_size=25, alpha=0.1, phi_cache_bytes=PHI_CACHE_BYTES,
+                 dtype=np.float32):
+        """
+        :param dtype: dtype of the agent's matrices, which should be that of the context vectors
+        """
         self.vector_size = vector_size
         self.num_users = num_users
         # alpha is measure of learning rate
         self.alpha = alpha
-        self.bias = np.zeros(vector_size * num_users, dtype=np.float32)
-        self.m = np.identity(num_users * vector_size, dtype=np.float32)
-        i_n = np.identity(num_users, dtype=np.float32)
+        self.bias = np.zeros(vector_size * num_users, dtype=dtype)
+        self.m = np.identity(num_users * vector_size, dtype=dtype)
+        i_n = np.identity(num_users, dtype=dtype)
         # construct a laplacian matrix based on the graph, that we will modify and then
         # take the kronecker product of to get a representation of the graph that helps us learn
         # although the laplacian is sp_sparse, if called on a dense matrix it will return a dense matrix
         laplacian = sp_sparse.csgraph.laplacian(graph)
         a = i_n + laplacian
-        i_d = np.identity(vector_size, dtype=np.float32)
-        self.a_kron = np.kron(a.astype(np.float32), i_d.astype(np.float32))
-        self.a_kron_exp = fractional_matrix_power(self.a_kron, -1 / 2).astype(np.float32)
-        self.m_inverse = np.identity(num_users * vector_size, dtype=np.float32)  # inverse of identity is inverse
-        self.context_ids_to_phis = {} # this gets reset with every iteration, but it's good to initialize everything
-        # in the __init__
+        i_d = np.identity(vector_size, dtype=dtype)
+        self.a_kron = np.kron(a.astype(dtype), i_d)
+        # fractional_matrix_power works in complex128 whatever the dtype, and the power of a symmetric positive
+        # definite matrix is real
+        self.a_kron_exp = np.real(fractional_matrix_power(self.a_kron, -1 / 2)).astype(dtype)
+        self.m_inverse = np.identity(num_users * vector_size, dtype=dtype)  # inverse of identity is inverse
+        # long phi vectors by (user_id, context_id), from choose to update and across rounds
+        self.phi_cache = PhiCache(phi_cache_bytes)
 
     def calculate_score(self, phi, timestep, w_t):
         """
@@ -45,40 +53,46 @@ class GOBLinAgent(AbstractAgent):
         """
         w_t = self.m_inverse.dot(self.bias)
         # new_contexts will contain the modified long phi vectors as described in the paper
-        new_contexts = []
-        for context in contexts:
-            context_id, context_vector = context
-            new_context = np.zeros(self.num_users * self.vector_size, dtype=np.float32)
-            for i in range(self.vector_size):
-                # the context_vector is placed in the new context such that it begins in block indexed by the
-                # current user, this provides a means of identifying to the algorithm which user is currently being
-                # examined. The block begins at user_id * self.vector_size, following which the vector is placed, with
-                # a length vector_size
-                new_context[i + user_id * self.vector_size] = np.float32(context_vector[i])
-            # modify long vector by graph information (self.a_kron_exp) to get encoding that takes into account graph
-            new_contexts.append(np.matmul(self.a_kron_exp, new_context))
+        new_contexts = [self.get_phi(user_id, context) for context in contexts]
         scores = [self.calculate_score(context, timestep, w_t) for context in new_contexts]
         max_context_index = np.argmax(scores)
-        # cache long phi vectors from choose to update to avoid recomputation
-        self.context_ids_to_phis = {}
-        for context, phi in zip(contexts, new_contexts):
-            context_id, context_vector = context
-            self.context_ids_to_phis[context_id] = phi
         return contexts[max_context_index]
 
+    def get_phi(self, user_id, context):
+        """
+        Long phi vector of a context for a user, from the cache unless it is not there
+        """
+        context_id, context_vector = context
+        return self.phi_cache.get((user_id, context_id), context_vector,
+                                  lambda: self.transform_context(user_id, context_vector))
+
+    def transform_context(self, user_id, context_vector):
+        """
+        Long phi vector of a context for a user
+        """
+        # the long vector holds the context_vector in the block indexed by the current user, which identifies to the
+        # algorithm which user is currently being examined, and is zero elsewhere. It is modified by graph information
+        # (a_kron_exp) to get an encoding that takes the graph into account, so only the user's block of columns of
+        # a_kron_exp contributes.
+        block = slice(user_id * self.vector_size, (user_id + 1) * self.vector_size)
+        return self.a_kron_exp[:, block].dot(context_vector)
+
+    def user_theta(self, user_id):
+        """
+        A context's score is w_t . (a_kron_exp . long vector), and the long vector is zero outside the user's block,
+        so the user's theta is the user's block of a_kron_exp (which is symmetric) times w_t
+        """
+        w_t = self.m_inverse.dot(self.bias)
+        block = slice(user_id * self.vector_size, (user_id + 1) * self.vector_size)
+        return self.a_kron_exp[block].dot(w_t)
+
     def update(self, payoff, context, user_id):
         """
         Updates matrices based on payoff of chosen context
         """
-        context_id, context_vector = context
-        # retrieve modified long vector phi associated with the context_id and stored in self.choose
-        phi = self.context_ids_to_phis[context_id]
+        # retrieve modified long vector phi, usually computed by self.choose
+        phi = self.get_phi(user_id, context)
         self.bias = self.bias + phi * payoff
-        # in order to dot properly, we need this represented as a vector_size*1 matrix, not a vector_size-long vector
-        phi = np.expand_dims(phi, axis=0)
-        phi_transpose = np.transpose(phi)
-        outer_product = np.matmul(phi_transpose, phi)
-        self.m = self.m + outer_product
-        # calculates matrix inverse using https://en.wikipedia.org/wiki/Sherman%E2%80%93Morrison_formula
-        numerator = multi_dot([self.m_inverse, phi_transpose, phi, self.m_inverse])
-        self.m_inverse = self.m_inverse - (numerator / (1 + multi_dot([phi, self.m_inverse, phi_transpose]).item()))
+        # m + phi phi^T, and its inverse by Sherman-Morrison, both in place
+        rank_one_update(self.m, phi)
+        sherman_morrison_update(self.m_inverse, phi)
@@ -0,0 +1,67 @@
+import hashlib
+import numpy as np
+
+
+class HashingContextEncoder:
+    """
+    Encodes a context from its tags without fitting anything, as a streaming alternative to TF-IDF + SVD.
+    Every tag is feature-hashed into one of num_buckets buckets with a random sign, and every bucket is mapped to
+    num_features dimensions by a fixed sparse random projection with nonzeros_per_bucket entries of +-1/sqrt(nonzeros)
+    per bucket. Both are derived from seeded hashes, so the same tag always encodes to the same vector.
+    A context is the sum of its tags' vectors scaled to unit length.
+    """
+
+    def __init__(self, num_features=25, num_buckets=1 << 20, nonzeros_per_bucket=3, seed=0, dtype=np.float32):
+        self.num_features = num_features
+        self.num_buckets = num_buckets
+        self.nonzeros_per_bucket = nonzeros_per_bucket
+        self.key = str(seed).encode()
+        # encodings of every tag seen so far, row tag_to_row[tag] of tag_table
+        self.tag_to_row = {}
+        self.tag_table = np.zeros((1024, num_features), dtype=dtype)
+
+    def _hash(self, value):
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8, key=self.key).digest(), "little")
+
+    def tag_row(self, tag):
+        """
+        :return: row of tag_table holding the encoding of tag
+        """
+        row = self.tag_to_row.get(tag)
+        if row is None:
+            row = len(self.tag_to_row)
+            if row == len(self.tag_table):
+                self.tag_table = np.concatenate([self.tag_table, np.zeros_like(self.tag_table)])
+            # feature hashing: bucket and sign of the tag
+            tag_hash = self._hash(tag)
+            bucket = tag_hash % self.num_buckets
+            sign = 1 if (tag_hash >> 63) & 1 else -1
+            # sparse random projection: the column of the bucket
+            for i in range(self.nonzeros_per_bucket):
+                entry_hash = self._hash("{}:{}".format(bucket, i))
+                entry_sign = 1 if (entry_hash >> 63) & 1 else -1
+                self.tag_table[row, entry_hash % self.num_features] += sign * entry_sign / np.sqrt(self.nonzeros_per_bucket)
+            self.tag_to_row[tag] = row
+        return row
+
+    def encode_tag(self, tag):
+        return self.tag_table[self.tag_row(tag)]
+
+    def encode(self, tags):
+        """
+        :return: unit length vector of a context with the given tags, of the dtype of the encoder
+        """
+        vector = np.zeros(self.num_features, dtype=self.tag_table.dtype)
+        for tag in tags:
+            vector += self.encode_tag(tag)
+        return normalize_rows(vector[np.newaxis])[0]
+
+
+def normalize_rows(vectors):
+    """
+    Scales every nonzero row of a matrix to unit length, in place
+    """
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1
+    vectors /= norms[:, np.newaxis]
+    return vectors
@@ -1,5 +1,6 @@
 from AbstractAgent import AbstractAgent
 from GOBLinAgent import GOBLinAgent
+from PhiCache import MAX_BYTES as PHI_CACHE_BYTES
 import numpy as np
 import scipy.sparse as sp_sparse
 from scipy.linalg import fractional_matrix_power
@@ -11,7 +12,8 @@ class MacroAgent(AbstractAgent):
     """
     Implementation of GOBLin Block algorithm
     """
-    def __init__(self, graph, num_users, cluster_data, vector_size=25, alpha=0.1):
+    def __init__(self, graph, num_users, cluster_data, vector_size=25, alpha=0.1, phi_cache_bytes=PHI_CACHE_BYTES,
+                 dtype=np.float32):
         if not cluster_data:
             raise Exception("No cluster data for macro algorithm")
 
@@ -19,7 +21,7 @@ class MacroAgent(AbstractAgent):
         self.idx_to_cluster = cluster_data[1]
 
         num_clusters = len(self.cluster_to_idx.keys())
-        clustered_graph = np.zeros((num_clusters, num_clusters), dtype=np.float32)
+        clustered_graph = np.zeros((num_clusters, num_clusters), dtype=dtype)
         for i in range(num_users):
             for j in range(num_users):
                 if graph[i][j]:
@@ -28,12 +30,17 @@ class MacroAgent(AbstractAgent):
                     if first_cluster != second_cluster:
                         clustered_graph[first_cluster][second_cluster] += 1
 
-        self.goblin_agent = GOBLinAgent(clustered_graph, num_clusters, vector_size, alpha)
+        self.goblin_agent = GOBLinAgent(clustered_graph, num_clusters, vector_size, alpha,
+                                        phi_cache_bytes=phi_cache_bytes, dtype=dtype)
 
     def choose(self, user_id, contexts, timestep):
         cluster_id = self.idx_to_cluster[user_id]
         return self.goblin_agent.choose(cluster_id, contexts, timestep)
 
+    def user_theta(self, user_id):
+        cluster_id = self.idx_to_cluster[user_id]
+        return self.goblin_agent.user_theta(cluster_id)
+
     def update(self, payoff, context, user_id):
         cluster_id = self.idx_to_cluster[user_id]
         self.goblin_agent.update(payoff, context, cluster_id)
\ No newline at end of file
@@ -0,0 +1,115 @@
+from AbstractAgent import AbstractAgent
+import numpy as np
+import scipy.sparse as sp_sparse
+from scipy.sparse.linalg import LinearOperator
+import math
+from conjugate_gradient import conjugate_gradient, TOL as CG_TOL
+
+
+class MatrixFreeGOBLinAgent(AbstractAgent):
+    """
+    GOBLin without any (n * d) x (n * d) matrix. GOBLin scores the long vector x of a context (the context vector in
+    the user's block, zero elsewhere) through phi = a_kron^-1/2 x and m = I + sum of phi phi^T, and substituting phi
+    gives the same scores with m' = a_kron + sum of x x^T:
+        w_t . phi = x^T m'^-1 b'  and  phi^T m^-1 phi = x^T m'^-1 x,  where b' = sum of payoff * x
+    m' is applied through the sparse graph and the history of chosen long vectors, and m'^-1 b' and m'^-1 x are solved
+    by conjugate gradient to relative tolerance tol, m'^-1 b' warm-started from the previous round and m'^-1 x from
+    zero.
+    Memory is that of the graph, the history (time steps * d) and a few vectors of n * d per context.
+    """
+
+    def __init__(self, graph, num_users, vector_size=25, alpha=0.1, tol=CG_TOL, dtype=np.float32):
+        """
+        :param graph: dense or scipy sparse adjacency matrix
+        :param dtype: dtype of the operator and vectors, which should be that of the context vectors
+        """
+        self.vector_size = vector_size
+        self.num_users = num_users
+        self.alpha = alpha
+        self.tol = tol
+        size = num_users * vector_size
+        laplacian = sp_sparse.csgraph.laplacian(sp_sparse.csr_matrix(graph, dtype=dtype))
+        self.a = (sp_sparse.identity(num_users, dtype=dtype, format="csr") + laplacian).tocsr()
+        self.bias = np.zeros(size, dtype=dtype)
+        # m'^-1 b', kept as the starting point of the next solve
+        self.w = np.zeros(size, dtype=dtype)
+        # diagonal of m' for the Jacobi preconditioner: the diagonal of a repeated d times, plus the squares of the
+        # chosen context vectors
+        self.diagonal = np.repeat(self.a.diagonal(), vector_size)
+        # chosen long vectors as the rows of a sparse matrix, d entries each, in arrays that double when full. The
+        # CSR matrix over them is made by the first solve after an update, without copying them
+        self.num_observed = 0
+        self.history_indices = np.zeros(1024 * vector_size, dtype=np.int32)
+        self.history_values = np.zeros(1024 * vector_size, dtype=dtype)
+        self.history_indptr = np.arange(0, 1025 * vector_size, vector_size, dtype=np.int32)
+        self.history = None
+        self.operator = LinearOperator((size, size), matvec=self._matmat, matmat=self._matmat, dtype=dtype)
+
+    def _matmat(self, vectors):
+        """
+        m' vectors, for an n * d vector or an (n * d) x k matrix
+        """
+        shape = vectors.shape
+        vectors = vectors.reshape(self.num_users, -1)
+        # a_kron = a (x) I_d acts on the (n, d * k) layout of the users' blocks
+        product = self.a.dot(vectors).reshape(shape)
+        if self.history is not None:
+            product += self.history.T.dot(self.history.dot(vectors.reshape(shape)))
+        return product
+
+    def _solve(self, rhs, x0):
+        if self.history is None and self.num_observed:
+            end = self.num_observed * self.vector_size
+            self.history = sp_sparse.csr_matrix(
+                (self.history_values[:end], self.history_indices[:end], self.history_indptr[:self.num_observed + 1]),
+                shape=(self.num_observed, len(self.bias)), copy=False)
+        solutions, _ = conjugate_gradient(self.operator, rhs, x0, tol=self.tol, inverse_diagonal=1 / self.diagonal)
+        return solutions
+
+    def _block(self, user_id):
+        return slice(user_id * self.vector_size, (user_id + 1) * self.vector_size)
+
+    def choose(self, user_id, contexts, timestep):
+        """
+        Chooses best context for user, taking into account exploration, at current timestep.
+        """
+        block = self._block(user_id)
+        context_vectors = np.array([context[1] for context in contexts])
+        # w and m'^-1 x of every context, in one solve with the long vectors as columns
+        rhs = np.zeros((len(self.bias), len(contexts) + 1), dtype=self.bias.dtype)
+        rhs[:, 0] = self.bias
+        rhs[block, 1:] = context_vectors.T
+        starts = np.zeros_like(rhs)
+        starts[:, 0] = self.w
+        solutions = self._solve(rhs, starts)
+        self.w = solutions[:, 0]
+        widths = np.einsum('ki,ik->k', context_vectors, solutions[block, 1:])
+        scores = context_vectors.dot(self.w[block]) + \
+            self.alpha * np.sqrt(np.maximum(widths, 0) * math.log(timestep + 1))
+        return contexts[np.argmax(scores)]
+
+    def user_theta(self, user_id):
+        """
+        A context's score is x^T m'^-1 b', and x is zero outside the user's block, so the user's theta is the user's
+        block of w
+        """
+        self.w = self._solve(self.bias[:, np.newaxis], self.w[:, np.newaxis])[:, 0]
+        return self.w[self._block(user_id)]
+
+    def update(self, payoff, context, user_id):
+        """
+        Adds the chosen long vector to the history, and its payoff to the bias
+        """
+        block = self._block(user_id)
+        context_vector = context[1]
+        self.bias[block] += context_vector * payoff
+        self.diagonal[block] += context_vector ** 2
+        start, end = self.num_observed * self.vector_size, (self.num_observed + 1) * self.vector_size
+        if end > len(self.history_values):
+            self.history_indices = np.concatenate([self.history_indices, np.zeros_like(self.history_indices)])
+            self.history_values = np.concatenate([self.history_values, np.zeros_like(self.history_values)])
+            self.history_indptr = np.arange(0, len(self.history_values) + 1, self.vector_size, dtype=np.int32)
+        self.history_indices[start:end] = np.arange(block.start, block.stop)
+        self.history_values[start:end] = context_vector
+        self.num_observed += 1
+        self.history = None
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+import numpy as np
+
+MAX_BYTES = 256 * 2 ** 20
+
+
+class PhiCache:
+    """
+    Least recently used cache of the graph-transformed long phi vectors of (user, context id) pairs, bounded by
+    the bytes of the vectors it holds. Contexts of a catalogue recur, so choose can reuse the phis of earlier rounds,
+    and update can find the phi of the chosen context whichever choose it came from.
+    Every phi is kept with the context vector it was computed from, and is recomputed when the context id comes back
+    with another vector (after TaggedUserContextManager.refit). With max_bytes 0 nothing is kept, for contexts whose
+    ids never repeat.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, context_vector, compute):
+        """
+        :param context_vector: the context vector the phi of key is computed from
+        :param compute: function without arguments returning the phi of key, called on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is not None and np.array_equal(entry[0], context_vector):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        phi = compute()
+        if not self.max_bytes:
+            return phi
+        if entry is not None:
+            del self.entries[key]
+            self.num_bytes -= entry[0].nbytes + entry[1].nbytes
+        self.entries[key] = (np.array(context_vector), phi)
+        self.num_bytes += context_vector.nbytes + phi.nbytes
+        while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (evicted_vector, evicted_phi) = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_vector.nbytes + evicted_phi.nbytes
+        return phi
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,100 @@
+import threading
+import queue
+from itertools import islice
+import numpy as np
+
+CHUNK_SIZE = 1 << 14  # logged events per chunk
+
+
+class ReplayEvaluator:
+    """
+    Offline evaluation of agents by rejection replay (Li et al., 2011) over logged (user, context, reward) events,
+    such as the lines of user_contexts.csv (a missing reward column counts as a reward of 1).
+    For every logged event, every agent is offered the logged context among pool_size - 1 contexts drawn uniformly
+    from the catalogue. If an agent chooses the logged context the event is matched: the agent is updated with the
+    logged reward, which is counted towards its payoff. Otherwise the event is discarded for that agent, since the
+    payoff of any other context is unknown.
+    Rejection replay is an unbiased estimate of an agent's payoff when the logging policy chose the logged context
+    uniformly at random from the pool it was shown. The logs hold no pools, only the contexts users interacted with,
+    so the pools here are synthetic and the estimate holds only as far as the logged contexts are such uniform choices.
+    Since every event has a positive reward, it measures how often an agent picks what the user picked out of random
+    contexts. As in the replay algorithm, an agent's time is the number of events it has matched, which is the
+    timestep its choose is given, not the position of the event in the log.
+    The log is streamed in chunks by a prefetch thread that reads ahead of the agents by at most prefetch_chunks
+    chunks, so memory is bounded regardless of the size of the log.
+    """
+
+    def __init__(self, log_path, contexts, agents, pool_size=25, chunk_size=CHUNK_SIZE, prefetch_chunks=2, seed=0):
+        """
+        :param contexts: the catalogue, a list of (context_id, context_vector) tuples
+        :param agents: dict from agent name to agent
+        """
+        self.log_path = log_path
+        self.contexts = contexts
+        self.context_dict = {context[0]: context for context in contexts}
+        self.agents = agents
+        self.pool_size = pool_size
+        self.chunk_size = chunk_size
+        self.prefetch_chunks = prefetch_chunks
+        self.rng = np.random.default_rng(seed)
+
+    def _read_chunks(self, chunks, max_events):
+        # runs in the prefetch thread, puts lists of events on chunks, then None once the log is exhausted, or the
+        # exception that stopped the reading, so that run never waits for a chunk that will not come
+        num_events = 0
+        end = None
+        try:
+            with open(self.log_path, "r") as f:
+                while max_events is None or num_events < max_events:
+                    size = self.chunk_size if max_events is None else min(self.chunk_size, max_events - num_events)
+                    lines = list(islice(f, size))
+                    if not lines:
+                        break
+                    events = []
+                    for line in lines:
+                        fields = line.strip().split(',')
+                        reward = float(fields[2]) if len(fields) > 2 else 1
+                        events.append((int(fields[0]), fields[1], reward))
+                    num_events += len(events)
+                    chunks.put(events)
+        except Exception as error:
+            end = error
+        finally:
+            chunks.put(end)
+
+    def run(self, max_events=None):
+        """
+        Replays up to max_events logged events (all of them if None)
+        :return: dict from agent name to dict of events, matched, payoff, match_rate and payoff_per_match
+        """
+        results = {name: {"events": 0, "matched": 0, "payoff": 0.0} for name in self.agents}
+        chunks = queue.Queue(maxsize=self.prefetch_chunks)
+        reader = threading.Thread(target=self._read_chunks, args=(chunks, max_events), daemon=True)
+        reader.start()
+        while True:
+            events = chunks.get()
+            if events is None:
+                break
+            if isinstance(events, Exception):
+                reader.join()
+                raise events
+            for user, context_id, reward in events:
+                logged_context = self.context_dict.get(context_id)
+                if logged_context is None:
+                    # no vector for this context, so no agent could have chosen it
+                    continue
+                pool = [self.contexts[i] for i in self.rng.integers(0, len(self.contexts), self.pool_size - 1)]
+                pool.insert(self.rng.integers(0, self.pool_size), logged_context)
+                for name, agent in self.agents.items():
+                    result = results[name]
+                    result["events"] += 1
+                    chosen_context = agent.choose(user, pool, result["matched"])
+                    if chosen_context[0] == context_id:
+                        agent.update(reward, chosen_context, user)
+                        result["matched"] += 1
+                        result["payoff"] += reward
+        reader.join()
+        for result in results.values():
+            result["match_rate"] = result["matched"] / result["events"] if result["events"] else 0.0
+            result["payoff_per_match"] = result["payoff"] / result["matched"] if result["matched"] else 0.0
+        return results
@@ -0,0 +1,51 @@
+import numpy as np
+import math
+
+
+class ReplicatedLinUCBAgent:
+    """
+    num_replicas independent LinUCB agents run in lockstep: every replica is offered its own user and contexts at
+    each step, and the users' matrices and biases of all replicas are stacked into (S, N, d, d) and (S, N, d) arrays,
+    so that choose and the Sherman-Morrison update are one vectorized operation across replicas.
+    Only m inverse is kept, as LinUCBAgent never reads m.
+    """
+
+    def __init__(self, num_replicas, num_users, num_features, alpha=0.1, is_sin=False, dtype=np.float32):
+        self.num_replicas = num_replicas
+        self.alpha = alpha
+        self.is_sin = is_sin
+        # If LinUCB-SIN, every user is treated as user 0
+        num_users = 1 if is_sin else num_users
+        self.m_inverse = np.tile(np.identity(num_features, dtype=dtype), (num_replicas, num_users, 1, 1))
+        self.b = np.zeros((num_replicas, num_users, num_features), dtype=dtype)
+        self.replicas = np.arange(num_replicas)
+
+    def _users(self, user_ids):
+        return np.zeros_like(user_ids) if self.is_sin else user_ids
+
+    def choose(self, user_ids, contexts, timestep):
+        """
+        :param user_ids: (S,) user of every replica
+        :param contexts: (S, K, d) contexts offered in every replica
+        :return: (S,) index of the chosen context of every replica
+        """
+        users = self._users(user_ids)
+        m_inverse = self.m_inverse[self.replicas, users]
+        w = np.einsum('sij,sj->si', m_inverse, self.b[self.replicas, users])
+        ucb = self.alpha * np.sqrt(np.einsum('ski,sij,skj->sk', contexts, m_inverse, contexts) * math.log(timestep + 1))
+        return np.argmax(np.einsum('ski,si->sk', contexts, w) + ucb, axis=1)
+
+    def update(self, payoffs, context_vectors, user_ids):
+        """
+        :param payoffs: (S,) payoff of every replica
+        :param context_vectors: (S, d) chosen context of every replica
+        :param user_ids: (S,) user of every replica
+        """
+        users = self._users(user_ids)
+        self.b[self.replicas, users] += context_vectors * payoffs[:, np.newaxis]
+        # Sherman-Morrison, m inverse is symmetric so m_inverse x x^T m_inverse = v v^T with v = m_inverse x
+        m_inverse = self.m_inverse[self.replicas, users]
+        v = np.einsum('sij,sj->si', m_inverse, context_vectors)
+        denominator = 1 + np.einsum('si,si->s', context_vectors, v)
+        self.m_inverse[self.replicas, users] = m_inverse - v[:, :, np.newaxis] * v[:, np.newaxis, :] / \
+            denominator[:, np.newaxis, np.newaxis]
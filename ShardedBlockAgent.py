@@ -0,0 +1,150 @@
+from AbstractAgent import AbstractAgent
+from BlockAgent import BlockAgent
+from PhiCache import MAX_BYTES as PHI_CACHE_BYTES
+import multiprocessing
+import numpy as np
+import scipy.sparse as sp_sparse
+
+
+def balance_clusters(cluster_to_idx, num_workers):
+    """
+    Assigns clusters to workers, largest first to the least loaded worker, where a cluster of n users costs n^2
+    (the size of its m_inverse and a_kron_exp per feature)
+    :return: list of num_workers lists of clusters
+    """
+    shards = [[] for _ in range(num_workers)]
+    loads = [0] * num_workers
+    for cluster in sorted(cluster_to_idx, key=lambda c: len(cluster_to_idx[c]), reverse=True):
+        worker = loads.index(min(loads))
+        shards[worker].append(cluster)
+        loads[worker] += len(cluster_to_idx[cluster]) ** 2
+    return shards
+
+
+def _serve_shard(connection, graph, cluster_to_idx, vector_size, alpha, memory_budget, phi_cache_bytes, dtype):
+    """
+    Worker process hosting a BlockAgent over the clusters of one shard. Messages are tuples whose first element is the
+    command; choose and theta are answered in the order they arrive, update is not answered.
+    """
+    idx_to_cluster = {user: cluster for cluster, users in cluster_to_idx.items() for user in users}
+    agent = BlockAgent(graph, graph.shape[0], (cluster_to_idx, idx_to_cluster), vector_size=vector_size, alpha=alpha,
+                       memory_budget=memory_budget, phi_cache_bytes=phi_cache_bytes, dtype=dtype)
+    connection.send("ready")
+    while True:
+        message = connection.recv()
+        command = message[0]
+        if command == "choose":
+            _, user_id, contexts, timestep = message
+            chosen_context = agent.choose(user_id, contexts, timestep)
+            connection.send(next(i for i, context in enumerate(contexts) if context is chosen_context))
+        elif command == "update":
+            _, payoff, context, user_id = message
+            agent.update(payoff, context, user_id)
+        elif command == "theta":
+            connection.send(agent.user_theta(message[1]))
+        elif command == "stop":
+            break
+    connection.close()
+
+
+class ShardedBlockAgent(AbstractAgent):
+    """
+    BlockAgent with its clusters spread over num_workers worker processes, balanced by cluster size squared.
+    Clusters never interact, so every choose and update is routed to the worker holding the user's cluster over a pipe,
+    and every worker only allocates the matrices of its own clusters, as they are first used.
+    update does not wait for the worker, so updates overlap with work on other shards, and choose_batch sends the
+    choices of a whole round before collecting them, so users in different shards are served in parallel.
+    Sharding only pays off through choose_batch, which main.simulate calls in rounds: choose serves one user at a
+    time, and only adds a round trip over a pipe to every step.
+    """
+
+    def __init__(self, graph, num_users, cluster_data, vector_size=25, alpha=0.1, num_workers=None,
+                 memory_budget=None, phi_cache_bytes=PHI_CACHE_BYTES, dtype=np.float32):
+        """
+        :param memory_budget: if set, bytes of cluster state every worker keeps in memory, see BlockAgent
+        :param phi_cache_bytes: bytes of long phi vectors every worker keeps for reuse, see PhiCache
+        :param dtype: dtype of the clusters' matrices, see BlockAgent
+        """
+        self.vector_size = vector_size
+        self.alpha = alpha
+        self.cluster_to_idx, self.idx_to_cluster = cluster_data
+        num_workers = min(num_workers or multiprocessing.cpu_count(), len(self.cluster_to_idx))
+        # workers get the graph as a sparse matrix, which is far smaller to send than the dense one
+        graph = sp_sparse.csr_matrix(graph)
+        self.cluster_to_worker = {}
+        self.connections = []
+        self.workers = []
+        for worker, clusters in enumerate(balance_clusters(self.cluster_to_idx, num_workers)):
+            for cluster in clusters:
+                self.cluster_to_worker[cluster] = worker
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_shard, daemon=True,
+                                              args=(worker_connection, graph,
+                                                    {cluster: self.cluster_to_idx[cluster] for cluster in clusters},
+                                                    vector_size, alpha, memory_budget, phi_cache_bytes, dtype))
+            process.start()
+            # the worker holds its own end now, so that recv raises EOFError instead of hanging if the worker dies
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(process)
+        # wait until every worker is up
+        for worker in range(len(self.workers)):
+            self._receive(worker)
+
+    def _worker(self, user_id):
+        return self.cluster_to_worker[self.idx_to_cluster[user_id]]
+
+    def _send(self, worker, message):
+        try:
+            self.connections[worker].send(message)
+        except (BrokenPipeError, ConnectionResetError):
+            self._worker_exited(worker)
+
+    def _receive(self, worker):
+        try:
+            return self.connections[worker].recv()
+        except (EOFError, ConnectionResetError):
+            self._worker_exited(worker)
+
+    def _worker_exited(self, worker):
+        process = self.workers[worker]
+        process.join(timeout=1)
+        raise Exception("Worker {} of the sharded block agent exited with code {}".format(worker, process.exitcode))
+
+    def choose(self, user_id, contexts, timestep):
+        """
+        Chooses best context for user, taking into account exploration, at current timestep.
+        """
+        return self.choose_batch([(user_id, contexts, timestep)])[0]
+
+    def choose_batch(self, requests):
+        """
+        Chooses for several users at once
+        :param requests: list of (user_id, contexts, timestep) tuples
+        :return: list of chosen contexts, in the order of requests
+        """
+        for user_id, contexts, timestep in requests:
+            self._send(self._worker(user_id), ("choose", user_id, contexts, timestep))
+        # pipes are first in first out, so the answers of every worker come back in the order they were asked
+        return [contexts[self._receive(self._worker(user_id))] for user_id, contexts, timestep in requests]
+
+    def update(self, payoff, context, user_id):
+        """
+        Updates matrices based on payoff of chosen context, without waiting for the worker
+        """
+        self._send(self._worker(user_id), ("update", payoff, context, user_id))
+
+    def user_theta(self, user_id):
+        worker = self._worker(user_id)
+        self._send(worker, ("theta", user_id))
+        return self._receive(worker)
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        for connection, process in zip(self.connections, self.workers):
+            if process.is_alive():
+                connection.send(("stop",))
+        for process in self.workers:
+            process.join()
@@ -0,0 +1,125 @@
+from AbstractAgent import AbstractAgent
+from UserStateStore import UserStateStore
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+import math
+from conjugate_gradient import conjugate_gradient, TOL as CG_TOL
+
+
+class SketchedLinUCBAgent(AbstractAgent):
+    """
+    LinUCB whose confidence widths x^T m^-1 x come from an approximate matrix m = I + sum of x x^T per user, in
+    O(d * rank) memory and time instead of O(d^2):
+    - diag keeps only the diagonal of m (rank is unused)
+    - fd keeps a Frequent Directions sketch s of 2 * rank rows of d, for 1 <= rank <= d / 2, for which
+      s^T s <= sum of x x^T <= s^T s + shrink I, and uses m = (1 + shrink) I + s^T s (as in sketched linear bandits,
+      Kuzborskij et al., 2019), whose widths are exact by Woodbury's identity
+    theta = m^-1 b is that of the exact m: after every update it is solved by conjugate gradient over the user's
+    chosen context vectors, to relative tolerance tol and warm-started from the previous theta. So the memory of a
+    user is the sketch, b and theta plus d per update of the user, which is less than LinUCB's d^2 while the user has
+    fewer than d updates. The chosen context vectors are kept in memory, also with a state_path.
+    """
+
+    def __init__(self, num_features, alpha=0.1, sketch="diag", rank=5, state_path=None, tol=CG_TOL,
+                 dtype=np.float32):
+        self.num_features = num_features
+        self.alpha = alpha
+        self.sketch = sketch
+        self.rank = rank
+        self.tol = tol
+        if sketch == "diag":
+            fields = {"precision": ((num_features,), 1)}
+        elif sketch == "fd":
+            # the shrinkage by the rank-th singular value needs that many, and empties a row only if the sketch has
+            # all of its 2 * rank rows
+            if not 1 <= rank <= num_features // 2:
+                raise Exception("Sketch rank {} not implemented! Try 1 to {}".format(rank, num_features // 2))
+            fields = {"sketch": ((2 * rank, num_features), 0), "shrink": ((), 0)}
+        else:
+            raise Exception("Sketch not implemented! Try diag, fd")
+        fields.update(b=((num_features,), 0), theta=((num_features,), 0))
+        self.user_information = UserStateStore(num_features, path=state_path, fields=fields, dtype=dtype)
+        # chosen context vectors of every user by slot, as the first history_lengths[slot] rows of an array that
+        # doubles when full
+        self.histories = {}
+        self.history_lengths = {}
+
+    def _solve(self, slot, vectors):
+        """
+        :param vectors: (K, d) matrix
+        :return: approximate m^-1 vectors^T as (K, d), for the user in slot
+        """
+        if self.sketch == "diag":
+            return vectors / self.user_information.precision[slot]
+        # m^-1 = (I - s^T (ridge I + s s^T)^-1 s) / ridge
+        sketch = self.user_information.sketch[slot]
+        ridge = 1 + self.user_information.shrink[slot]
+        gram = ridge * np.identity(len(sketch), dtype=sketch.dtype) + sketch.dot(sketch.T)
+        projected = np.linalg.solve(gram, sketch.dot(vectors.T))
+        return (vectors - projected.T.dot(sketch)) / ridge
+
+    def _solve_theta(self, slot):
+        """
+        Exact m^-1 b of the user in slot, with m = I + history^T history applied through the history
+        """
+        history = self.histories[slot][:self.history_lengths[slot]]
+        operator = LinearOperator((self.num_features, self.num_features), dtype=history.dtype,
+                                  matvec=lambda v: v + history.T.dot(history.dot(v)),
+                                  matmat=lambda v: v + history.T.dot(history.dot(v)))
+        inverse_diagonal = 1 / (1 + np.einsum('ij,ij->j', history, history))
+        theta, _ = conjugate_gradient(operator, self.user_information.b[slot][:, np.newaxis],
+                                      self.user_information.theta[slot][:, np.newaxis], tol=self.tol,
+                                      inverse_diagonal=inverse_diagonal)
+        return theta[:, 0]
+
+    def choose(self, user_id, contexts, timestep):
+        """
+        Chooses best context for user, taking into account exploration, at current timestep.
+        """
+        slot = self.user_information.slot(user_id)
+        context_vectors = np.array([context[1] for context in contexts])
+        widths = np.einsum('ki,ki->k', context_vectors, self._solve(slot, context_vectors))
+        scores = context_vectors.dot(self.user_information.theta[slot]) + \
+            self.alpha * np.sqrt(np.maximum(widths, 0) * math.log(timestep + 1))
+        return contexts[np.argmax(scores)]
+
+    def user_theta(self, user_id):
+        if user_id not in self.user_information:
+            return None
+        return self.user_information.theta[self.user_information.slot(user_id)]
+
+    def history_nbytes(self):
+        return sum(history.nbytes for history in self.histories.values())
+
+    def update(self, payoff, context, user_id):
+        """
+        Updates the sketch, the history and the bias based on payoff of chosen context, and solves theta again
+        """
+        slot = self.user_information.slot(user_id)
+        context_vector = context[1]
+        self.user_information.b[slot] += context_vector * payoff
+        history = self.histories.get(slot)
+        length = self.history_lengths.get(slot, 0)
+        if history is None or length == len(history):
+            grown = np.empty((max(2 * length, 4), self.num_features), dtype=self.user_information.dtype)
+            if length:
+                grown[:length] = history
+            self.histories[slot] = history = grown
+        history[length] = context_vector
+        self.history_lengths[slot] = length + 1
+        self.user_information.theta[slot] = self._solve_theta(slot)
+        if self.sketch == "diag":
+            self.user_information.precision[slot] += context_vector ** 2
+            return
+        sketch = self.user_information.sketch[slot]
+        empty_rows = np.flatnonzero(~sketch.any(axis=1))
+        if not len(empty_rows):
+            # Frequent Directions: shrink the sketch's squared singular values by the rank-th largest, which
+            # empties at least half of its rows, and remember the total shrinkage
+            _, singular_values, directions = np.linalg.svd(sketch, full_matrices=False)
+            delta = singular_values[self.rank - 1] ** 2
+            shrunk = np.sqrt(np.maximum(singular_values ** 2 - delta, 0))
+            sketch[:] = shrunk[:, np.newaxis] * directions
+            self.user_information.shrink[slot] += delta
+            empty_rows = np.flatnonzero(~sketch.any(axis=1))
+        sketch[empty_rows[0]] = context_vector
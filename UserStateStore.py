@@ -0,0 +1,80 @@
+import os
+import numpy as np
+
+
+class UserStateStore:
+    """
+    State of every user in contiguous arrays of dtype, one per field, with a dict from user id to the user's slot (row)
+    of all of them. By default the fields are LinUCB's m_inverse (U, d, d) and b (U, d). Slots are given out in order
+    of first appearance, and the arrays double in capacity when full. With a path, the arrays are memory-mapped .npy
+    files, path_<field>.npy, so the operating system pages cold users out; the id to slot index is kept in memory.
+    """
+
+    def __init__(self, num_features, capacity=1024, path=None, fields=None, dtype=np.float32):
+        """
+        :param fields: dict from field name to (shape of one user's array, initial value of it)
+        """
+        self.num_features = num_features
+        self.path = path
+        self.dtype = dtype
+        self.slots = {}
+        if fields is None:
+            # m starts as the identity, so m_inverse does too
+            fields = {"m_inverse": ((num_features, num_features), np.identity(num_features, dtype=dtype)),
+                      "b": ((num_features,), 0)}
+        self.fields = fields
+        for name, (shape, _) in fields.items():
+            setattr(self, name, self._allocate(name, (capacity,) + shape))
+        self._initialize(0, capacity)
+
+    def _allocate(self, name, shape):
+        if self.path is None:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.lib.format.open_memmap("{}_{}.npy".format(self.path, name), mode="w+", dtype=self.dtype,
+                                         shape=shape)
+
+    def _initialize(self, start, end):
+        for name, (_, initial) in self.fields.items():
+            getattr(self, name)[start:end] = initial
+
+    def capacity(self):
+        return len(getattr(self, next(iter(self.fields))))
+
+    def _grow(self):
+        capacity = self.capacity()
+        for name in self.fields:
+            array = getattr(self, name)
+            if self.path is None:
+                grown = np.empty((2 * capacity,) + array.shape[1:], dtype=self.dtype)
+                grown[:capacity] = array
+            else:
+                # write the grown array next to the old one, then swap the files
+                final_path = "{}_{}.npy".format(self.path, name)
+                grown = np.lib.format.open_memmap(final_path + ".grow", mode="w+", dtype=self.dtype,
+                                                  shape=(2 * capacity,) + array.shape[1:])
+                grown[:capacity] = array
+                grown.flush()
+                os.replace(final_path + ".grow", final_path)
+            setattr(self, name, grown)
+        self._initialize(capacity, 2 * capacity)
+
+    def __contains__(self, user_id):
+        return user_id in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, user_id):
+        """
+        Slot of user_id, given out (with the initial state) on its first appearance
+        """
+        slot = self.slots.get(user_id)
+        if slot is None:
+            slot = len(self.slots)
+            if slot == self.capacity():
+                self._grow()
+            self.slots[user_id] = slot
+        return slot
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.fields)
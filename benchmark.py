@@ -0,0 +1,496 @@
+import sys
+import os
+import getopt
+import time
+import random
+import shutil
+import tempfile
+import importlib.util
+import numpy
+import graph_io
+'''
+Benchmarks, run one at a time:
+
+ python benchmark.py -b preprocess      <--- legacy delicious preprocessing against process_delicious.py
+ python benchmark.py -b encoders        <--- load time and payoff of svd against hash context encoders
+ python benchmark.py -b startup         <--- import and first-run time of main with eager against lazy imports
+ python benchmark.py -b replicas        <--- wall time of sequential 4cliques linucb runs against lockstep replicas
+ python benchmark.py -b rank1           <--- Sherman-Morrison update of a large m_inverse, out of place against in place
+ python benchmark.py -b userstate       <--- memory per user and update rate of per-user objects against UserStateStore
+ python benchmark.py -b shards          <--- steps/sec and per-process memory of block against sharded block agents
+ python benchmark.py -b sketch          <--- payoff, memory per user and steps/sec of linucb against sketched linucb
+ python benchmark.py -b dtype           <--- memory, steps/sec and payoff of every --dtype of main
+
+Options:
+ -b: benchmark name
+ --rows: number of synthetic rows generated for raw files missing from the dataset, or rows of the matrix for rank1
+ --steps: time steps per simulated run
+ --seeds: number of simulated runs averaged per setting
+ --clusters: number of clusters of the lastfm graph used by cluster agents
+ --workers: largest number of worker processes (threads for rank1), doubled from 1
+ --batch: users served per round by sharded agents
+ --replicas: number of replicas simulated in lockstep
+ --users: number of users created by userstate
+ --rank: rank of the Frequent Directions sketches of sketch
+'''
+
+DELICIOUS_RAW = "delicious"
+DELICIOUS_PROCESSED = "delicious-processed"
+TAGGED_DATASETS = ["lastfm-processed", DELICIOUS_PROCESSED]
+TAGGED_DATASET_FILES = ["context_names.csv", "context_tags.csv", "user_contexts.csv"]
+NUM_FEATURES = 25
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def load_module_from(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_synthetic_delicious(raw_dir, num_rows, users):
+    """
+    Writes random stand-ins for the delicious raw files that are not checked in, in the same formats
+    """
+    rng = random.Random(0)
+    with open(os.path.join(raw_dir, "tags.dat")) as f:
+        tag_ids = [line.split()[0] for line in f][1:2001]
+    if not os.path.exists(os.path.join(raw_dir, "bookmark_tags.dat")):
+        with open(os.path.join(raw_dir, "bookmark_tags.dat"), "w") as f:
+            f.write("bookmarkID\ttagID\ttagWeight\n")
+            for _ in range(num_rows):
+                f.write("{}\t{}\t{}\n".format(rng.randrange(num_rows // 4), rng.choice(tag_ids), rng.randint(1, 5)))
+    if not os.path.exists(os.path.join(raw_dir, "user_taggedbookmarks.dat")):
+        with open(os.path.join(raw_dir, "user_taggedbookmarks.dat"), "w") as f:
+            f.write("userID\tbookmarkID\ttagID\tday\tmonth\tyear\thour\tminute\tsecond\n")
+            for _ in range(num_rows):
+                f.write("{}\t{}\t{}\t1\t1\t2010\t0\t0\t0\n".format(rng.choice(users), rng.randrange(num_rows // 4),
+                                                                  rng.choice(tag_ids)))
+    if not os.path.exists(os.path.join(raw_dir, "bookmarks.dat")):
+        with open(os.path.join(raw_dir, "bookmarks.dat"), "w") as f:
+            f.write("id\tmd5\ttitle\turl\tmd5Principal\turlPrincipal\n")
+            for bookmark in range(num_rows // 4):
+                f.write("{}\tx\tbookmark {}\thttp://x\tx\tx\n".format(bookmark, bookmark))
+
+
+def benchmark_preprocess(options):
+    """
+    Times the legacy delicious scripts and the linear-time pipeline on the same raw files
+    """
+    num_rows = int(options.get('--rows', 5000))
+    process_delicious = load_module_from(os.path.join(DELICIOUS_PROCESSED, "process_delicious.py"), "process_delicious")
+    working_dir = tempfile.mkdtemp()
+    raw_dir = os.path.join(working_dir, "raw")
+    os.makedirs(raw_dir)
+    for filename in os.listdir(DELICIOUS_RAW):
+        shutil.copy(os.path.join(DELICIOUS_RAW, filename), raw_dir)
+    with open(os.path.join(raw_dir, "user_contacts.dat")) as f:
+        users = sorted({line.split()[0] for line in f} - {"userID"})
+    write_synthetic_delicious(raw_dir, num_rows, users)
+
+    # the legacy scripts read and write their files in the working directory
+    cwd = os.getcwd()
+    os.chdir(raw_dir)
+    try:
+        def legacy_graph():
+            graph_loader = load_module_from(os.path.join(cwd, DELICIOUS_PROCESSED, "graph_loader.py"), "graph_loader")
+            graph_loader.user_to_index()
+            graph_loader.extra_users()
+            return graph_loader.createMatrix()
+
+        def legacy_context_tags():
+            context_loader = load_module_from(os.path.join(cwd, DELICIOUS_PROCESSED, "context_loader.py"),
+                                              "context_loader")
+            data, tag_appearances = context_loader.get_bookmark_tags()
+            split = context_loader.split_tags(data.copy(), "-", tag_appearances)
+            return context_loader.split_tags(split.copy(), "_", tag_appearances)
+
+        _, legacy_graph_time = timed(legacy_graph)
+        _, legacy_context_time = timed(legacy_context_tags)
+    finally:
+        os.chdir(cwd)
+
+    _, graph_time = timed(process_delicious.build_graph, raw_dir, working_dir)
+    _, context_time = timed(process_delicious.build_context_tags, raw_dir, working_dir)
+    _, user_context_time = timed(process_delicious.build_user_contexts, raw_dir, working_dir)
+    _, pipeline_time = timed(process_delicious.main, True, raw_dir, working_dir)
+    shutil.rmtree(working_dir)
+
+    print("{:<28}{:>12}{:>12}".format("stage", "legacy (s)", "new (s)"))
+    print("{:<28}{:>12.3f}{:>12.3f}".format("graph", legacy_graph_time, graph_time))
+    print("{:<28}{:>12.3f}{:>12.3f}".format("context_tags", legacy_context_time, context_time))
+    print("{:<28}{:>12}{:>12.3f}".format("user_contexts", "-", user_context_time))
+    print("{:<28}{:>12}{:>12.3f}".format("full pipeline", "-", pipeline_time))
+
+
+def available_datasets():
+    datasets = []
+    for dataset in TAGGED_DATASETS:
+        missing = [f for f in TAGGED_DATASET_FILES if not os.path.exists(os.path.join(dataset, f))]
+        if missing:
+            print("Skipping {}, missing {} (run its preprocessing first).".format(dataset, ", ".join(missing)))
+        else:
+            datasets.append(dataset)
+    return datasets
+
+
+def mean_final_payoff(user_context_manager, make_agent, num_steps, num_seeds):
+    """
+    Cumulative payoff relative to random choice after num_steps, averaged over num_seeds runs
+    """
+    import main
+    import load
+    finals = []
+    normalizing_agent = load.load_agent('dummy', NUM_FEATURES, 0, None, None)
+    for seed in range(num_seeds):
+        random.seed(seed)
+        numpy.random.seed(seed)
+        results = main.simulate(user_context_manager, make_agent(), normalizing_agent, num_steps, progress=False)
+        finals.append(results[-1])
+    return sum(finals) / len(finals)
+
+
+def benchmark_encoders(options):
+    """
+    Compares TF-IDF + SVD context vectors with hashed context vectors by load time and by LinUCB payoff
+    """
+    import load
+    num_steps = int(options.get('--steps', 5000))
+    num_seeds = int(options.get('--seeds', 3))
+    alpha = 0.1
+    datasets = available_datasets()
+    print("{:<22}{:>8}{:>12}{:>20}".format("dataset", "encoder", "load (s)", "payoff vs random"))
+    for dataset in datasets:
+        num_users = graph_io.read_num_nodes(dataset)
+        true_associations = load.load_true_associations(dataset)
+        for encoder in ["svd", "hash"]:
+            if encoder == "svd":
+                (context_ids, context_vectors), load_time = timed(load.load_and_generate_contexts, dataset,
+                                                                  num_features=NUM_FEATURES)
+            else:
+                (context_ids, context_vectors, _), load_time = timed(load.load_hashed_contexts, dataset,
+                                                                    num_features=NUM_FEATURES)
+            user_context_manager = load.TaggedUserContextManager(num_users, true_associations, context_ids,
+                                                                 context_vectors)
+            payoff = mean_final_payoff(user_context_manager,
+                                       lambda: load.load_agent('linucb', NUM_FEATURES, alpha, None, None),
+                                       num_steps, num_seeds)
+            print("{:<22}{:>8}{:>12.3f}{:>20.1f}".format(dataset, encoder, load_time, payoff))
+
+
+def peak_rss_mb(pid="self"):
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmHWM"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def run_rounds(user_context_manager, agent, num_steps, batch_size):
+    """
+    Serves num_steps users in rounds of batch_size, choosing for the whole round before updating
+    :return: steps per second
+    """
+    start = time.perf_counter()
+    for _ in range(0, num_steps, batch_size):
+        requests = [user_context_manager.get_user_and_contexts() + (step,) for step in range(batch_size)]
+        if hasattr(agent, "choose_batch"):
+            chosen_contexts = agent.choose_batch(requests)
+        else:
+            chosen_contexts = [agent.choose(*request) for request in requests]
+        for (user_id, _, _), context in zip(requests, chosen_contexts):
+            agent.update(user_context_manager.get_payoff(user_id, context), context, user_id)
+    if hasattr(agent, "user_theta"):
+        # waits until every update has been applied
+        agent.user_theta(requests[0][0])
+    return num_steps / (time.perf_counter() - start)
+
+
+def benchmark_shards(options):
+    """
+    Compares an in-process BlockAgent with ShardedBlockAgent over increasing numbers of workers on lastfm
+    """
+    import load
+    from ShardedBlockAgent import ShardedBlockAgent
+    num_steps = int(options.get('--steps', 2000))
+    num_clusters = int(options.get('--clusters', 50))
+    max_workers = int(options.get('--workers', os.cpu_count()))
+    batch_size = int(options.get('--batch', 16))
+    user_context_manager, graph, cluster_to_idx, idx_to_cluster = load.load_data("lastfm-processed",
+                                                                                 num_features=NUM_FEATURES,
+                                                                                 num_clusters=num_clusters)
+    cluster_data = (cluster_to_idx, idx_to_cluster)
+    print("{:<14}{:>14}{:>16}".format("workers", "steps/s", "max RSS (MB)"))
+    agent = load.load_agent('block', NUM_FEATURES, 0.1, graph, cluster_data)
+    steps_per_second = run_rounds(user_context_manager, agent, num_steps, batch_size)
+    print("{:<14}{:>14.1f}{:>16.0f}".format("in-process", steps_per_second, peak_rss_mb()))
+    del agent
+    num_workers = 1
+    while num_workers <= max_workers:
+        agent = ShardedBlockAgent(graph, len(graph), cluster_data, vector_size=NUM_FEATURES, num_workers=num_workers)
+        steps_per_second = run_rounds(user_context_manager, agent, num_steps, batch_size)
+        worker_rss = max(peak_rss_mb(process.pid) for process in agent.workers)
+        agent.close()
+        print("{:<14}{:>14.1f}{:>16.0f}".format(num_workers, steps_per_second, worker_rss))
+        num_workers *= 2
+
+
+HEAVY_MODULES = ["matplotlib.pyplot", "tqdm", "sklearn", "scipy.sparse", "scipy.linalg"]
+EAGER_IMPORTS = "import matplotlib.pyplot, tqdm, sklearn.feature_extraction.text, sklearn.decomposition, " \
+                "scipy.sparse, scipy.linalg, DummyAgent, LinUCBAgent, GOBLinAgent, BlockAgent, ShardedBlockAgent, " \
+                "MacroAgent, ContextProjector, graph_io\n"
+STARTUP_SCENARIOS = [
+    ("import main", "import main\n"),
+    ("4cliques linucb, 100 steps", "import main, load\n"
+                                   "manager, graph, _, _ = load.load_data('4cliques')\n"
+                                   "agent = load.load_agent('linucb', 25, 0.1, graph, None)\n"
+                                   "main.simulate(manager, agent, load.load_agent('dummy', 25, 0.1, graph, None), 100, "
+                                   "progress=False)\n"),
+]
+
+
+def time_fresh_interpreter(code, repeats):
+    """
+    Runs code in a new interpreter repeats times
+    :return: fastest time in seconds, heavy modules imported by the code
+    """
+    import subprocess
+    script = "import sys, time\nstart = time.perf_counter()\n" + code + \
+             "print(time.perf_counter() - start)\n" \
+             "print(','.join(m for m in {} if m in sys.modules))\n".format(HEAVY_MODULES)
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        elapsed, modules = output.split("\n")[-3:-1]
+        times.append(float(elapsed))
+    return min(times), modules
+
+
+def benchmark_startup(options):
+    """
+    Times importing main and a short 4cliques run in a fresh interpreter, with the heavy dependencies and every agent
+    imported up front (as main and load used to) and with the lazy imports
+    """
+    repeats = int(options.get('--seeds', 3))
+    print("{:<30}{:>12}{:>12}  {}".format("scenario", "eager (s)", "lazy (s)", "heavy modules imported when lazy"))
+    for name, code in STARTUP_SCENARIOS:
+        eager_time, _ = time_fresh_interpreter(EAGER_IMPORTS + code, repeats)
+        lazy_time, modules = time_fresh_interpreter(code, repeats)
+        print("{:<30}{:>12.3f}{:>12.3f}  {}".format(name, eager_time, lazy_time, modules or "-"))
+
+
+def benchmark_replicas(options):
+    """
+    Times --seeds sequential 4cliques LinUCB runs of main.simulate against --replicas runs in lockstep
+    """
+    import main
+    import load
+    from ReplicatedLinUCBAgent import ReplicatedLinUCBAgent
+    num_steps = int(options.get('--steps', 10000))
+    num_seeds = int(options.get('--seeds', 3))
+    num_replicas = int(options.get('--replicas', 100))
+    alpha = 0.1
+    start = time.perf_counter()
+    finals = []
+    for seed in range(num_seeds):
+        random.seed(seed)
+        numpy.random.seed(seed)
+        user_context_manager, graph, _, _ = load.load_data("4cliques", num_features=NUM_FEATURES)
+        results = main.simulate(user_context_manager, load.load_agent('linucb', NUM_FEATURES, alpha, graph, None),
+                                load.load_agent('dummy', NUM_FEATURES, alpha, graph, None), num_steps, progress=False)
+        finals.append(results[-1])
+    sequential_time = time.perf_counter() - start
+    replicas = load.FourCliquesReplicas(num_replicas, epsilon=0.1, num_features=NUM_FEATURES, seed=0)
+    agent = ReplicatedLinUCBAgent(num_replicas, replicas.num_users, NUM_FEATURES, alpha)
+    results, replicated_time = timed(main.simulate_replicas, replicas, agent, num_steps, progress=False)
+    print("{:<24}{:>8}{:>12}{:>16}{:>20}".format("mode", "runs", "time (s)", "s per run", "mean final payoff"))
+    print("{:<24}{:>8}{:>12.2f}{:>16.3f}{:>20.1f}".format("sequential", num_seeds, sequential_time,
+                                                          sequential_time / num_seeds, sum(finals) / num_seeds))
+    print("{:<24}{:>8}{:>12.2f}{:>16.3f}{:>20.1f}".format("lockstep replicas", num_replicas, replicated_time,
+                                                          replicated_time / num_replicas, results[:, -1].mean()))
+
+
+def benchmark_rank1(options):
+    """
+    Times the Sherman-Morrison update of a --rows x --rows m_inverse as the agents used to compute it (out of place,
+    through the full numerator) and with the blocked in-place kernel over increasing numbers of threads
+    """
+    import sherman_morrison
+    from numpy.linalg import multi_dot
+    size = int(options.get('--rows', 10000))
+    max_threads = int(options.get('--workers', os.cpu_count()))
+    repeats = int(options.get('--seeds', 3))
+    rng = numpy.random.default_rng(0)
+    m_inverse = numpy.identity(size, dtype=numpy.float32)
+    phis = [rng.standard_normal(size).astype(numpy.float32) / numpy.sqrt(size) for _ in range(repeats)]
+
+    def out_of_place(m_inverse, phi):
+        phi = numpy.expand_dims(phi, axis=0)
+        phi_transpose = numpy.transpose(phi)
+        numerator = multi_dot([m_inverse, phi_transpose, phi, m_inverse])
+        return m_inverse - (numerator / (1 + multi_dot([phi, m_inverse, phi_transpose]).item()))
+
+    print("{:<24}{:>16}".format("update", "ms per update"))
+    _, elapsed = timed(lambda: [out_of_place(m_inverse, phi) for phi in phis])
+    print("{:<24}{:>16.1f}".format("out of place", 1000 * elapsed / repeats))
+    num_threads = 1
+    while num_threads <= max_threads:
+        sherman_morrison.NUM_THREADS = num_threads
+        sherman_morrison._pool = None
+        _, elapsed = timed(lambda: [sherman_morrison.sherman_morrison_update(m_inverse, phi) for phi in phis])
+        print("{:<24}{:>16.1f}".format("in place, {} threads".format(num_threads), 1000 * elapsed / repeats))
+        num_threads *= 2
+
+
+def benchmark_userstate(options):
+    """
+    Creates and updates --users LinUCB users, stored as one object of three arrays per user (as LinUCBAgent used to)
+    and in a UserStateStore, and reports the memory per user and the updates per second
+    """
+    import tracemalloc
+    from collections import defaultdict
+    from UserStateStore import UserStateStore
+    num_users = int(options.get('--users', 100000))
+    rng = numpy.random.default_rng(0)
+    contexts = rng.standard_normal((1024, NUM_FEATURES)).astype(numpy.float32)
+
+    class MatrixBias:
+        def __init__(self):
+            self.M = numpy.identity(NUM_FEATURES, dtype=numpy.float32)
+            self.b = numpy.zeros(NUM_FEATURES, dtype=numpy.float32)
+            self.Minv = numpy.linalg.inv(self.M)
+
+    def update_objects(users):
+        for user in range(num_users):
+            state = users[user]
+            x = contexts[user % len(contexts)]
+            state.b += x
+            state.M += numpy.outer(x, x)
+            u = state.Minv.dot(x)
+            state.Minv -= numpy.outer(u, u) / (1 + x.dot(u))
+        return users
+
+    def update_store(store):
+        for user in range(num_users):
+            slot = store.slot(user)
+            x = contexts[user % len(contexts)]
+            store.b[slot] += x
+            m_inverse = store.m_inverse[slot]
+            u = m_inverse.dot(x)
+            m_inverse -= numpy.outer(u, u) / (1 + x.dot(u))
+        return store
+
+    print("{:<24}{:>18}{:>18}{:>18}".format("storage", "bytes per user", "peak per user", "updates/s"))
+    print("{:<24}{:>18}".format("raw 4 (d^2 + d)", 4 * (NUM_FEATURES ** 2 + NUM_FEATURES)))
+    for name, run, make in [("object per user", update_objects, lambda: defaultdict(MatrixBias)),
+                            ("UserStateStore", update_store, lambda: UserStateStore(NUM_FEATURES))]:
+        tracemalloc.start()
+        users, elapsed = timed(run, make())
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del users
+        print("{:<24}{:>18.0f}{:>18.0f}{:>18.0f}".format(name, current / num_users, peak / num_users,
+                                                         num_users / elapsed))
+
+
+def benchmark_sketch(options):
+    """
+    Compares exact LinUCB with its diagonal and Frequent Directions approximations (see SketchedLinUCBAgent) on
+    4cliques and the available tagged datasets, by payoff relative to random choice, state per user and steps/sec
+    """
+    import load
+    num_steps = int(options.get('--steps', 5000))
+    num_seeds = int(options.get('--seeds', 3))
+    sketch_rank = int(options.get('--rank', load.SKETCH_RANK))
+    alpha = 0.1
+    print("{:<22}{:>12}{:>16}{:>12}{:>20}".format("dataset", "algorithm", "bytes per user", "steps/s",
+                                                  "payoff vs random"))
+    for dataset in ["4cliques"] + available_datasets():
+        user_context_manager = load.load_data(dataset, num_features=NUM_FEATURES)[0]
+        for algorithm_name in ["linucb", "linucbdiag", "linucbfd"]:
+            agents = []
+
+            def make_agent():
+                agents.append(load.load_agent(algorithm_name, NUM_FEATURES, alpha, None, None,
+                                              sketch_rank=sketch_rank))
+                return agents[-1]
+
+            payoff, elapsed = timed(mean_final_payoff, user_context_manager, make_agent, num_steps, num_seeds)
+            agent = agents[-1]
+            # slots of the user state, and the chosen context vectors the sketched agents solve theta over
+            bytes_per_user = agent.user_information.nbytes() / agent.user_information.capacity()
+            if hasattr(agent, "history_nbytes"):
+                bytes_per_user += agent.history_nbytes() / len(agent.user_information)
+            print("{:<22}{:>12}{:>16.0f}{:>12.0f}{:>20.1f}".format(dataset, algorithm_name, bytes_per_user,
+                                                                   num_steps * num_seeds / elapsed, payoff))
+
+
+def benchmark_dtype(options):
+    """
+    Loads 4cliques and the available tagged datasets in every dtype of load.DTYPES, and runs linucb (and goblin on
+    4cliques) on them, reporting the memory held by the data and by the agent, the peak, steps/sec and the payoff
+    """
+    import tracemalloc
+    import main
+    import load
+    num_steps = int(options.get('--steps', 2000))
+    alpha = 0.1
+    print("{:<22}{:>9}{:>10}{:>11}{:>12}{:>11}{:>10}{:>20}".format("dataset", "dtype", "algorithm", "data (MB)",
+                                                                   "agent (MB)", "peak (MB)", "steps/s",
+                                                                   "payoff vs random"))
+    for dataset in ["4cliques"] + available_datasets():
+        # a first load and run imports everything, so that the measured ones only allocate data
+        main.simulate(load.load_data(dataset, num_features=NUM_FEATURES)[0],
+                      load.load_agent('linucb', NUM_FEATURES, alpha, None, None),
+                      load.load_agent('dummy', NUM_FEATURES, alpha, None, None), 10, progress=False)
+        for algorithm_name in ["linucb", "goblin"] if dataset == "4cliques" else ["linucb"]:
+            for dtype in load.DTYPES:
+                random.seed(0)
+                numpy.random.seed(0)
+                tracemalloc.start()
+                user_context_manager, graph, _, _ = load.load_data(dataset, num_features=NUM_FEATURES, dtype=dtype)
+                data_bytes = tracemalloc.get_traced_memory()[0]
+                agent = load.load_agent(algorithm_name, NUM_FEATURES, alpha, graph, None,
+                                        cache_phis=not user_context_manager.UNIQUE_CONTEXT_IDS, dtype=dtype)
+                normalizing_agent = load.load_agent('dummy', NUM_FEATURES, alpha, graph, None)
+                results, elapsed = timed(main.simulate, user_context_manager, agent, normalizing_agent, num_steps,
+                                         progress=False)
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print("{:<22}{:>9}{:>10}{:>11.1f}{:>12.1f}{:>11.1f}{:>10.0f}{:>20.1f}".format(
+                    dataset, dtype, algorithm_name, data_bytes / 2 ** 20, (current - data_bytes) / 2 ** 20,
+                    peak / 2 ** 20, num_steps / elapsed, results[-1]))
+                del user_context_manager, graph, agent
+
+
+BENCHMARKS = {
+    'preprocess': benchmark_preprocess,
+    'encoders': benchmark_encoders,
+    'startup': benchmark_startup,
+    'replicas': benchmark_replicas,
+    'rank1': benchmark_rank1,
+    'userstate': benchmark_userstate,
+    'shards': benchmark_shards,
+    'sketch': benchmark_sketch,
+    'dtype': benchmark_dtype,
+}
+
+
+def main():
+    options = dict(getopt.getopt(sys.argv[1:], "b:", ['rows=', 'steps=', 'seeds=', 'clusters=',
+                                                                     'workers=', 'batch=', 'replicas=', 'users=',
+                                                                     'rank='])[0])
+    name = options.get('-b', 'preprocess')
+    if name not in BENCHMARKS:
+        raise Exception("Benchmark {} not found in {}.".format(name, list(BENCHMARKS.keys())))
+    BENCHMARKS[name](options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+'''
+Preconditioned conjugate gradient on several right-hand sides at once, for symmetric positive definite operators
+that are only available as products (scipy.sparse.linalg.LinearOperator). Every column is an independent solve, but
+each iteration applies the operator to all columns in one matmat, which is where the time goes.
+'''
+
+TOL = 1e-4  # relative residual norm at which a column is solved
+MAX_ITERATIONS = 200
+
+
+def conjugate_gradient(operator, rhs, x0=None, tol=TOL, max_iterations=MAX_ITERATIONS, inverse_diagonal=None):
+    """
+    Solves operator x = rhs for every column of rhs
+    :param operator: n x n LinearOperator (or matrix), symmetric positive definite
+    :param rhs: n x k matrix
+    :param x0: n x k starting guess (warm start), zeros if None
+    :param inverse_diagonal: n vector, inverse of the diagonal of the operator (Jacobi preconditioner), or None
+    :return: n x k solutions, number of iterations taken
+    """
+    x = np.zeros_like(rhs) if x0 is None else np.array(x0, dtype=rhs.dtype)
+    residual = rhs - operator.matmat(x)
+    preconditioned = residual if inverse_diagonal is None else residual * inverse_diagonal[:, np.newaxis]
+    direction = preconditioned.copy()
+    residual_dot = np.einsum('ij,ij->j', residual, preconditioned)
+    targets = tol * np.linalg.norm(rhs, axis=0)
+    for iteration in range(max_iterations):
+        active = np.linalg.norm(residual, axis=0) > targets
+        if not active.any():
+            return x, iteration
+        product = operator.matmat(direction)
+        curvature = np.einsum('ij,ij->j', direction, product)
+        # solved columns (and directions the operator maps to zero) stay where they are
+        step = np.where(active & (curvature > 0), residual_dot / np.where(curvature > 0, curvature, 1), 0)
+        x += direction * step
+        residual -= product * step
+        preconditioned = residual if inverse_diagonal is None else residual * inverse_diagonal[:, np.newaxis]
+        new_residual_dot = np.einsum('ij,ij->j', residual, preconditioned)
+        beta = np.where(residual_dot > 0, new_residual_dot / np.where(residual_dot > 0, residual_dot, 1), 0)
+        direction = preconditioned + direction * beta
+        residual_dot = new_residual_dot
+    return x, max_iterations
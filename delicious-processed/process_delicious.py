@@ -0,0 +1,157 @@
+import os
+import sys
+import csv
+import getopt
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import graph_io
+from pipeline import Stage, STATE_FILENAME, read_chunks, run_pipeline
+'''
+Linear-time replacement for graph_loader.py, context_loader.py, context_name_loader.py and payoff_loader.py.
+Users, edges and tags are looked up through dicts and sets instead of list scans, and every output
+is streamed to disk. Runs as a pipeline of stages (see pipeline.py):
+ graph:         user_contacts.dat, user_taggedbookmarks.dat -> graph_edges.csv, user_index.csv
+ context_tags:  bookmark_tags.dat, tags.dat -> context_tags.csv
+ user_contexts: user_taggedbookmarks.dat, user_index.csv -> user_contexts.csv
+ context_names: bookmarks.dat -> context_names.csv
+A stage is skipped when its inputs are unchanged since it last ran, --force reruns every stage. Only
+user_contacts.dat and tags.dat are checked in, the other raw files come from the delicious dump
+(hetrec2011-delicious-2k), and stages whose inputs are missing are skipped.
+'''
+
+PROCESSED_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(PROCESSED_DIR, "..", "delicious")
+MIN_TAG_WEIGHT = 10  # tags used less often than this across all bookmarks are dropped
+
+
+def build_graph(raw_dir, processed_dir):
+    """
+    Users are indexed as graph_loader.py indexed them, which the clustered_graph.part.* partitions are computed over:
+    in order of first appearance in the first column of user_contacts.dat, followed by the users who only tagged
+    bookmarks and have no connections. Every connection is written once.
+    """
+    user_to_user_idx = {}
+    for lines in read_chunks(os.path.join(raw_dir, "user_contacts.dat"), skip_header=True):
+        for line in lines:
+            user = line.split()[0]
+            if user not in user_to_user_idx:
+                user_to_user_idx[user] = len(user_to_user_idx)
+    for lines in read_chunks(os.path.join(raw_dir, "user_taggedbookmarks.dat"), skip_header=True):
+        for line in lines:
+            user = line.split()[0]
+            if user not in user_to_user_idx:
+                user_to_user_idx[user] = len(user_to_user_idx)
+
+    def edge_chunks():
+        seen = set()
+        for lines in read_chunks(os.path.join(raw_dir, "user_contacts.dat"), skip_header=True):
+            sources, targets = [], []
+            for line in lines:
+                user, contact = line.split()[:2]
+                if contact not in user_to_user_idx:
+                    # graph_loader.py failed on these as well, indexing them would shift the partitions' users
+                    raise Exception("Contact {} of user {} is not a user of user_contacts.dat or "
+                                    "user_taggedbookmarks.dat".format(contact, user))
+                user_idx, contact_idx = user_to_user_idx[user], user_to_user_idx[contact]
+                edge = (min(user_idx, contact_idx), max(user_idx, contact_idx))
+                if edge not in seen:
+                    seen.add(edge)
+                    sources.append(user_idx)
+                    targets.append(contact_idx)
+            yield sources, targets
+
+    graph_io.write_edge_list(os.path.join(processed_dir, graph_io.EDGE_LIST_FILENAME), len(user_to_user_idx),
+                             edge_chunks())
+    with open(os.path.join(processed_dir, "user_index.csv"), "w") as outfile:
+        for user, user_idx in user_to_user_idx.items():
+            outfile.write("{},{}\n".format(user, user_idx))
+    print("{} users.".format(len(user_to_user_idx)))
+
+
+def build_context_tags(raw_dir, processed_dir):
+    tag_names = {}
+    for lines in read_chunks(os.path.join(raw_dir, "tags.dat"), skip_header=True):
+        for line in lines:
+            tag_id, name = line.split()[:2]
+            tag_names[tag_id] = name
+
+    # first pass totals the weight of every tag, second pass writes the tags that are frequent enough
+    tag_appearances = defaultdict(int)
+    for lines in read_chunks(os.path.join(raw_dir, "bookmark_tags.dat"), skip_header=True):
+        for line in lines:
+            _, tag_id, weight = line.split()
+            tag_appearances[tag_names[tag_id]] += int(weight)
+
+    unique_tags = set()
+    with open(os.path.join(processed_dir, "context_tags.csv"), "w") as outfile:
+        for lines in read_chunks(os.path.join(raw_dir, "bookmark_tags.dat"), skip_header=True):
+            out_lines = []
+            for line in lines:
+                bookmark, tag_id, _ = line.split()
+                name = tag_names[tag_id]
+                if tag_appearances[name] < MIN_TAG_WEIGHT:
+                    continue
+                # split by hyphens and underscores
+                split_tags = name.replace('_', '-').split('-')
+                unique_tags.update(split_tags)
+                out_lines.extend("{},{}\n".format(bookmark, split_tag) for split_tag in split_tags)
+            outfile.writelines(out_lines)
+    print("{} unique tags after splitting.".format(len(unique_tags)))
+
+
+def build_user_contexts(raw_dir, processed_dir):
+    user_to_user_idx = {}
+    for lines in read_chunks(os.path.join(processed_dir, "user_index.csv")):
+        for line in lines:
+            user, user_idx = line.strip().split(',')
+            user_to_user_idx[user] = int(user_idx)
+
+    # user_taggedbookmarks has one row per tag, a bookmark is associated with its user only once
+    seen = set()
+    with open(os.path.join(processed_dir, "user_contexts.csv"), "w") as outfile:
+        for lines in read_chunks(os.path.join(raw_dir, "user_taggedbookmarks.dat"), skip_header=True):
+            out_lines = []
+            for line in lines:
+                user, bookmark = line.split()[:2]
+                pair = (user_to_user_idx[user], bookmark)
+                if pair not in seen:
+                    seen.add(pair)
+                    out_lines.append("{},{}\n".format(*pair))
+            outfile.writelines(out_lines)
+
+
+def build_context_names(raw_dir, processed_dir):
+    with open(os.path.join(processed_dir, "context_names.csv"), mode='w') as csvfile:
+        writer = csv.writer(csvfile, delimiter=',')
+        for lines in read_chunks(os.path.join(raw_dir, "bookmarks.dat"), skip_header=True, encoding="latin-1"):
+            writer.writerows([row.split("\t")[0], row.split("\t")[2]] for row in lines)
+
+
+def make_stages(raw_dir=RAW_DIR, processed_dir=PROCESSED_DIR):
+    def raw(filename):
+        return os.path.join(raw_dir, filename)
+
+    def processed(filename):
+        return os.path.join(processed_dir, filename)
+
+    return [
+        Stage("graph", [raw("user_contacts.dat"), raw("user_taggedbookmarks.dat")],
+              [processed(graph_io.EDGE_LIST_FILENAME), processed("user_index.csv")],
+              lambda: build_graph(raw_dir, processed_dir)),
+        Stage("context_tags", [raw("bookmark_tags.dat"), raw("tags.dat")], [processed("context_tags.csv")],
+              lambda: build_context_tags(raw_dir, processed_dir)),
+        Stage("user_contexts", [raw("user_taggedbookmarks.dat"), processed("user_index.csv")],
+              [processed("user_contexts.csv")], lambda: build_user_contexts(raw_dir, processed_dir)),
+        Stage("context_names", [raw("bookmarks.dat")], [processed("context_names.csv")],
+              lambda: build_context_names(raw_dir, processed_dir)),
+    ]
+
+
+def main(force=False, raw_dir=RAW_DIR, processed_dir=PROCESSED_DIR):
+    run_pipeline(make_stages(raw_dir, processed_dir), os.path.join(processed_dir, STATE_FILENAME), force=force)
+
+
+if __name__ == '__main__':
+    options = dict(getopt.getopt(sys.argv[1:], "", ['force'])[0])
+    main(force='--force' in options)
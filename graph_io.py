@@ -0,0 +1,142 @@
+'''
+Reading and writing of the social network graph in sparse form.
+
+The sparse graph is stored as an edge list, graph_edges.csv:
+
+ 1892           <--- number of users
+ 0,1            <--- edge between user 0 and user 1 (users are zero-indexed)
+ 0,2,3          <--- an optional third column gives the edge weight, which must be positive
+ ...
+
+Edges may be listed in one or both directions, loaders symmetrize the graph.
+A graph may also be stored as a scipy CSR matrix (graph.npz), and older datasets
+provide a dense adjacency matrix (graph.csv), which is still read row by row.
+'''
+import os
+from itertools import islice
+import numpy as np
+import scipy.sparse as sp_sparse
+
+EDGE_LIST_FILENAME = "graph_edges.csv"
+CSR_FILENAME = "graph.npz"
+DENSE_FILENAME = "graph.csv"
+CHUNK_SIZE = 1 << 16
+
+
+def iter_edge_list_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Streams an edge list file, yielding (sources, targets, weights) arrays of at most chunk_size edges
+    """
+    with open(path, "r") as infile:
+        infile.readline()  # number of nodes, see read_num_nodes
+        while True:
+            lines = list(islice(infile, chunk_size))
+            if not lines:
+                break
+            edges = np.loadtxt(lines, delimiter=',', ndmin=2)
+            weights = edges[:, 2] if edges.shape[1] > 2 else np.ones(len(edges))
+            yield edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64), weights
+
+
+def iter_dense_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Streams a dense adjacency matrix csv one row at a time, yielding the nonzero entries of up to
+    chunk_size rows at a time as (sources, targets, weights)
+    """
+    with open(path, "r") as infile:
+        row_id = 0
+        while True:
+            lines = list(islice(infile, chunk_size))
+            if not lines:
+                break
+            sources, targets, weights = [], [], []
+            for line in lines:
+                row = np.array(line.split(','), dtype=np.float64)
+                adjacent = np.flatnonzero(row)
+                sources.append(np.full(len(adjacent), row_id, dtype=np.int64))
+                targets.append(adjacent)
+                weights.append(row[adjacent])
+                row_id += 1
+            yield np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+
+
+def read_num_nodes(directory):
+    """
+    Number of nodes of the graph stored in directory, without reading the edges
+    """
+    edge_list_path = os.path.join(directory, EDGE_LIST_FILENAME)
+    csr_path = os.path.join(directory, CSR_FILENAME)
+    if os.path.exists(edge_list_path):
+        with open(edge_list_path, "r") as infile:
+            return int(infile.readline())
+    elif os.path.exists(csr_path):
+        with np.load(csr_path) as stored:
+            return int(stored["shape"][0])
+    with open(os.path.join(directory, DENSE_FILENAME), "r") as infile:
+        return len(infile.readline().split(','))
+
+
+def iter_graph_chunks(directory, chunk_size=CHUNK_SIZE):
+    """
+    Streams the edges of the graph stored in directory, whichever of the supported formats it is stored in
+    """
+    edge_list_path = os.path.join(directory, EDGE_LIST_FILENAME)
+    csr_path = os.path.join(directory, CSR_FILENAME)
+    if os.path.exists(edge_list_path):
+        return iter_edge_list_chunks(edge_list_path, chunk_size)
+    elif os.path.exists(csr_path):
+        coo = sp_sparse.load_npz(csr_path).tocoo()
+        return ((coo.row[i:i + chunk_size].astype(np.int64), coo.col[i:i + chunk_size].astype(np.int64),
+                 coo.data[i:i + chunk_size].astype(np.float64)) for i in range(0, coo.nnz, chunk_size))
+    return iter_dense_chunks(os.path.join(directory, DENSE_FILENAME), chunk_size)
+
+
+def load_sparse_graph(directory, weighted=False, chunk_size=CHUNK_SIZE):
+    """
+    Loads the graph stored in directory as a symmetric CSR matrix without self loops.
+    Memory use is O(edges). If weighted is False every edge has weight 1, otherwise repeated entries are summed
+    and an edge listed in both directions keeps the larger of its two weights, which is why weights must be positive.
+    :return: CSR adjacency matrix, number of nodes
+    """
+    num_nodes = read_num_nodes(directory)
+    sources, targets, weights = [], [], []
+    for chunk_sources, chunk_targets, chunk_weights in iter_graph_chunks(directory, chunk_size):
+        sources.append(chunk_sources)
+        targets.append(chunk_targets)
+        weights.append(chunk_weights)
+    if sources:
+        sources, targets, weights = np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+    else:
+        sources, targets, weights = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    if not weighted:
+        weights = np.ones(len(weights))
+    elif (weights <= 0).any():
+        raise Exception("Edge weights must be positive, {} edges of {} are not".format(
+            np.count_nonzero(weights <= 0), directory))
+    not_self_loop = sources != targets
+    sources, targets, weights = sources[not_self_loop], targets[not_self_loop], weights[not_self_loop]
+    graph = sp_sparse.coo_matrix((weights, (sources, targets)), shape=(num_nodes, num_nodes)).tocsr()
+    if not weighted:
+        graph.data[:] = 1
+    # mirror every edge, so that the graph is undirected
+    graph = graph.maximum(graph.T).tocsr()
+    graph.sort_indices()
+    return graph, num_nodes
+
+
+def write_edge_list(path, num_nodes, edge_chunks):
+    """
+    Writes an edge list in the graph_edges.csv format from an iterable of (sources, targets) or
+    (sources, targets, weights) chunks
+    """
+    with open(path, "w") as outfile:
+        outfile.write("{}\n".format(num_nodes))
+        for chunk in edge_chunks:
+            columns = [np.asarray(column) for column in chunk]
+            if not len(columns[0]):
+                continue
+            if len(columns) > 2:
+                lines = ("{},{},{:g}".format(*edge) for edge in zip(*columns))
+            else:
+                lines = ("{},{}".format(*edge) for edge in zip(*columns))
+            outfile.write("\n".join(lines) + "\n")
@@ -1,93 +1,116 @@
-from collections import defaultdict
-from itertools import chain
-import codecs
+import os
+import sys
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import graph_io
+from pipeline import Stage, STATE_FILENAME, read_chunks, run_pipeline
+'''
+split by underscores and hyphens
+
+Runs as a pipeline of stages (see pipeline.py), each of which streams its input files in chunks:
+ graph:         user_friends.dat -> graph_edges.csv, user_index.csv
+ context_tags:  user_taggedartists.dat, tags.dat -> context_tags.csv
+ user_contexts: user_artists.dat, user_index.csv -> user_contexts.csv
+ context_names: artists.dat -> context_names.csv
+A stage is skipped when its inputs are unchanged since it last ran, --force reruns every stage.
 '''
-split by underscores and hyphens'''
-def main():
-    # start by creating the social network adjacency matrix
-    userfile = open("../lastfm/user_friends.dat", "r")
+
+PROCESSED_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(PROCESSED_DIR, "..", "lastfm")
+
+
+def raw(filename):
+    return os.path.join(RAW_DIR, filename)
+
+
+def processed(filename):
+    return os.path.join(PROCESSED_DIR, filename)
+
+
+def build_graph():
+    # start by creating the social network, users are indexed in order of first appearance
     user_to_user_idx = {}
-    cur_idx = 0
-    user_friend_pairs = []
-    for line in userfile:
-        if line.split()[0] != "userID":
-            user_id, friend_id = line.split()
+    for lines in read_chunks(raw("user_friends.dat"), skip_header=True):
+        for line in lines:
+            user_id = line.split()[0]
             if user_id not in user_to_user_idx:
-                user_to_user_idx[user_id] = cur_idx
-                cur_idx += 1
-            user_friend_pairs.append((user_id, friend_id))
-    user_friend_pairs = [(user_to_user_idx[user_friend[0]], user_to_user_idx[user_friend[1]]) for user_friend in user_friend_pairs] 
-    num_users = cur_idx
+                user_to_user_idx[user_id] = len(user_to_user_idx)
+    num_users = len(user_to_user_idx)
     print("{} users.".format(num_users))
-    matrix = [[0 for i in range(num_users)] for i in range(num_users)] 
-
-    for pair in user_friend_pairs:
-        user, friend = pair
-        matrix[user][friend] = 1
-
-    userfile.close()
-    outfile = open("graph.csv", 'w')
-    for line in matrix:
-        outfile.write(",".join(str(i) for i in line) + '\n')
-    outfile.close()
-
-    # process tags
-
-    user_artist_tag_file = open("../lastfm/user_taggedartists.dat", "r")
-    artist_tag_id = defaultdict(list)
-    for line in user_artist_tag_file:
-        if line.split()[0] != "userID":
-            _, artist_id, tag_id, _, _, _ = line.split()
-            artist_tag_id[artist_id].append(tag_id)
-    user_artist_tag_file.close()
-    tag_id_tag_file = codecs.open("../lastfm/tags.dat", "r", encoding='latin-1')
+
+    def edge_chunks():
+        for lines in read_chunks(raw("user_friends.dat"), skip_header=True):
+            pairs = [line.split() for line in lines]
+            yield ([user_to_user_idx[user_id] for user_id, _ in pairs],
+                   [user_to_user_idx[friend_id] for _, friend_id in pairs])
+
+    graph_io.write_edge_list(processed(graph_io.EDGE_LIST_FILENAME), num_users, edge_chunks())
+    with open(processed("user_index.csv"), "w") as outfile:
+        for user_id, user_idx in user_to_user_idx.items():
+            outfile.write("{},{}\n".format(user_id, user_idx))
+
+
+def build_context_tags():
     tag_id_tag_name = dict()
-    for line in tag_id_tag_file:
-        line = str(line)
-        if line.split()[0] != "tagID":
+    for lines in read_chunks(raw("tags.dat"), skip_header=True, encoding='latin-1'):
+        for line in lines:
             tag_id, tag_name = line.split('\t')
-            tag_name = tag_name.strip()
-            tag_id_tag_name[tag_id] = tag_name
-    tag_id_tag_file.close()
-    artist_tag_names_unsplit = {artist_id: [tag_id_tag_name[tag_id] for tag_id in tags] for artist_id, tags in artist_tag_id.items()}
-    
-    artist_tag_names_split = {artist_id: chain.from_iterable(tag.replace('-', ' ').replace('_', ' ').split(' ') for tag in tags)
-                            for artist_id, tags in artist_tag_names_unsplit.items()}
-    unique_tags = set(chain.from_iterable(artist_tag_names_unsplit.values())) 
+            tag_id_tag_name[tag_id] = tag_name.strip()
+
+    unique_tags = set()
+    with open(processed("context_tags.csv"), "w") as artist_tag_outfile:
+        for lines in read_chunks(raw("user_taggedartists.dat"), skip_header=True):
+            out_lines = []
+            for line in lines:
+                _, artist_id, tag_id, _, _, _ = line.split()
+                tag = tag_id_tag_name[tag_id]
+                split_tags = tag.replace('-', ' ').replace('_', ' ').split(' ')
+                unique_tags.update(split_tags)
+                out_lines.extend("{},{}\n".format(artist_id, split_tag) for split_tag in split_tags)
+            artist_tag_outfile.writelines(out_lines)
     print("{} unique tags after splitting.".format(len(unique_tags)))
-    artist_tag_names_kvps = chain.from_iterable([(artist_id, tag) for tag in tags] for artist_id, tags in artist_tag_names_split.items())    
-    artist_tag_outfile = open("context_tags.csv", "w") 
-    for pair in artist_tag_names_kvps:
-        artist_tag_outfile.write(",".join(pair) + '\n')
-    artist_tag_outfile.close()
-
-    user_artist_file = open("../lastfm/user_artists.dat", "r")
-    user_artist_out_file = open("user_contexts.csv", "w")
-    for line in user_artist_file:
-        if "userID" not in line:
-            user_id, artist_id, _ = line.split()
-            user_idx = user_to_user_idx[user_id]
-            user_artist_out_file.write("{},{}\n".format(user_idx, artist_id))
-    user_artist_out_file.close()
-    user_artist_file.close()
 
+
+def build_user_contexts():
+    user_to_user_idx = {}
+    for lines in read_chunks(processed("user_index.csv")):
+        for line in lines:
+            user_id, user_idx = line.strip().split(',')
+            user_to_user_idx[user_id] = int(user_idx)
+
+    with open(processed("user_contexts.csv"), "w") as user_artist_out_file:
+        for lines in read_chunks(raw("user_artists.dat"), skip_header=True):
+            for line in lines:
+                user_id, artist_id, _ = line.split()
+                user_artist_out_file.write("{},{}\n".format(user_to_user_idx[user_id], artist_id))
+
+
+def build_context_names():
     # copy across associations between contexts and context_name
-    context_name_file = open("../lastfm/artists.dat", "r")
-    context_name_out = open("context_names.csv", "w")
-    reading = False
-    for line in context_name_file:
-        if not reading:
-            reading = True
-        else:
-            context = line.split('\t')[0]
-            name = line.split()[1]
-            context_name_out.write("{},{}\n".format(context, name))
-    context_name_file.close()
-    context_name_out.close()
-        
+    with open(processed("context_names.csv"), "w") as context_name_out:
+        for lines in read_chunks(raw("artists.dat"), skip_header=True):
+            for line in lines:
+                context = line.split('\t')[0]
+                name = line.split()[1]
+                context_name_out.write("{},{}\n".format(context, name))
+
+
+STAGES = [
+    Stage("graph", [raw("user_friends.dat")],
+          [processed(graph_io.EDGE_LIST_FILENAME), processed("user_index.csv")], build_graph),
+    Stage("context_tags", [raw("user_taggedartists.dat"), raw("tags.dat")],
+          [processed("context_tags.csv")], build_context_tags),
+    Stage("user_contexts", [raw("user_artists.dat"), processed("user_index.csv")],
+          [processed("user_contexts.csv")], build_user_contexts),
+    Stage("context_names", [raw("artists.dat")], [processed("context_names.csv")], build_context_names),
+]
 
-    
 
+def main(force=False):
+    run_pipeline(STAGES, processed(STATE_FILENAME), force=force)
 
 
-main()
+if __name__ == '__main__':
+    options = dict(getopt.getopt(sys.argv[1:], "", ['force'])[0])
+    main(force='--force' in options)
@@ -1,15 +1,17 @@
 from AbstractUserContextManager import AbstractUserContextManager
-from DummyAgent import DummyAgent
-from GOBLinAgent import GOBLinAgent
-from LinUCBAgent import LinUCBAgent
-from BlockAgent import BlockAgent
-from MacroAgent import MacroAgent
 import numpy
-from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.decomposition import TruncatedSVD
+from HashingContextEncoder import HashingContextEncoder, normalize_rows
 from collections import defaultdict
+import importlib
+import threading
+from itertools import islice
 import uuid
 import random
+from PhiCache import MAX_BYTES as PHI_CACHE_BYTES
+
+CONTEXT_CHUNK_SIZE = 1 << 16
+DTYPES = ["float32", "float64"]  # dtypes of the context vectors, graphs and agent state (the first is the default)
+CLUSTER_COUNTS = [5, 10, 20, 50, 100, 200]  # partitions of the graph stored with each dataset
 
 
 class FourCliquesContextManager(AbstractUserContextManager):
@@ -23,15 +25,17 @@ class FourCliquesContextManager(AbstractUserContextManager):
     CLIQUE_SIZE = 25
     NUM_CLIQUES = 4
     PROVIDED_CONTEXTS = 10
+    UNIQUE_CONTEXT_IDS = True
 
-    def __init__(self, epsilon=0.0, num_features=25):
+    def __init__(self, epsilon=0.0, num_features=25, dtype=numpy.float32):
         self.user_vectors = []
         # user_vectors will contain NUM_CLIQUES * CLIQUE_SIZE vectors, CLIQUE_SIZE of the same vector for each clique
         self.epsilon = epsilon
         self.num_features = num_features
+        self.dtype = dtype
 
         for i in range(self.NUM_CLIQUES):
-            rand_vector = numpy.random.uniform(low=-1, high=1, size=(num_features,))
+            rand_vector = numpy.random.uniform(low=-1, high=1, size=(num_features,)).astype(dtype)
             norm = numpy.linalg.norm(rand_vector)
             rand_vector = rand_vector / norm
             for j in range(self.CLIQUE_SIZE):
@@ -39,18 +43,16 @@ class FourCliquesContextManager(AbstractUserContextManager):
 
     def get_user_and_contexts(self):
         # since 4cliques has no "real" contexts, we generate PROVIDED_CONTEXTS context vectors on the fly
-        # to be chosen from for our chosen user
+        # to be chosen from for our chosen user, all at once as the rows of a matrix of the dtype
         user = random.randrange(0, self.NUM_CLIQUES * self.CLIQUE_SIZE)
-        context_vectors = []
-        for i in range(self.PROVIDED_CONTEXTS):
-            # generate random context vector of length 1
-            rand_vector = numpy.random.uniform(low=-1, high=1, size=(self.num_features,))
-            norm = numpy.linalg.norm(rand_vector)
-            rand_vector = rand_vector / norm
-            # contexts are associated with a unique identifier, in 4cliques, as each context is uniquely generated,
-            # we generate a unique identifier for each context before releasing it. For other datasets, this unique
-            # identifier is provided in the dataset.
-            context_vectors.append((uuid.uuid1(), rand_vector))
+        rand_vectors = numpy.random.uniform(low=-1, high=1,
+                                            size=(self.PROVIDED_CONTEXTS, self.num_features)).astype(self.dtype)
+        # every context vector has length 1
+        rand_vectors /= numpy.linalg.norm(rand_vectors, axis=1, keepdims=True)
+        # contexts are associated with a unique identifier, in 4cliques, as each context is uniquely generated,
+        # we generate a unique identifier for each context before releasing it. For other datasets, this unique
+        # identifier is provided in the dataset.
+        context_vectors = [(uuid.uuid1(), rand_vector) for rand_vector in rand_vectors]
 
         return user, context_vectors
 
@@ -61,7 +63,7 @@ class FourCliquesContextManager(AbstractUserContextManager):
         return numpy.dot(user_vector, context_vector) + numpy.random.uniform(-self.epsilon, self.epsilon)
 
     @classmethod
-    def generate_cliques(cls, threshold):
+    def generate_cliques(cls, threshold, dtype=numpy.float32):
         graph = numpy.zeros((100, 100))
         # creates a block adjacency matrix with 4 25 x 25 blocks of ones
         # along the diagonal corresponding to each clique
@@ -87,32 +89,98 @@ class FourCliquesContextManager(AbstractUserContextManager):
         result = numpy.logical_xor(graph, above_threshold)
         # logical xor returns trues and falses, we need ones and zeroes, which we produce with another
         # vectorized function
-        convert_from_true_false_to_1_0 = numpy.vectorize(lambda x: 1 if x else 0)
+        convert_from_true_false_to_1_0 = numpy.vectorize(lambda x: 1 if x else 0, otypes=[dtype])
         return convert_from_true_false_to_1_0(result)
 
 
+class FourCliquesReplicas:
+    """
+    num_replicas independent FourCliquesContextManagers drawn in lockstep, each with its own user vectors,
+    for ReplicatedLinUCBAgent. Every step draws one user and PROVIDED_CONTEXTS contexts per replica at once.
+    """
+
+    def __init__(self, num_replicas, epsilon=0.0, num_features=25, seed=None, dtype=numpy.float32):
+        self.num_replicas = num_replicas
+        self.epsilon = epsilon
+        self.num_features = num_features
+        self.dtype = dtype
+        self.rng = numpy.random.default_rng(seed)
+        clique_vectors = self._unit_vectors((num_replicas, FourCliquesContextManager.NUM_CLIQUES))
+        self.user_vectors = numpy.repeat(clique_vectors, FourCliquesContextManager.CLIQUE_SIZE, axis=1)
+        self.num_users = self.user_vectors.shape[1]
+
+    def _unit_vectors(self, shape):
+        vectors = self.rng.uniform(low=-1, high=1, size=shape + (self.num_features,)).astype(self.dtype)
+        return vectors / numpy.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    def get_users_and_contexts(self):
+        """
+        :return: (S,) user of every replica, (S, PROVIDED_CONTEXTS, d) contexts of every replica
+        """
+        users = self.rng.integers(0, self.num_users, self.num_replicas)
+        return users, self._unit_vectors((self.num_replicas, FourCliquesContextManager.PROVIDED_CONTEXTS))
+
+    def get_payoffs(self, users, context_vectors):
+        """
+        :param context_vectors: (S, d) chosen context of every replica
+        """
+        payoffs = numpy.einsum('si,si->s', self.user_vectors[numpy.arange(self.num_replicas), users], context_vectors)
+        return payoffs + self.rng.uniform(-self.epsilon, self.epsilon, self.num_replicas)
+
+
 class TaggedUserContextManager(AbstractUserContextManager):
     """
     For a social network with num_users users associated truly with contexts true_associations. 
     For get_user_and_contexts, returns a random collection of context vectors such that one is
     truly associated with the user. To compute payoff, returns 1 if the context is truly associated
     with the user and zero otherwise.
+
+    Given the tags of the contexts (tag_matrix, tag_to_idx) and the projector that embedded them, new contexts
+    can be added while running with add_contexts. Once the share of tag assignments that the projector was not
+    fit on exceeds refit_threshold, the projector is refit over the whole catalogue in a background thread.
+    Contexts encoded by a HashingContextEncoder (encoder) are added without any of this bookkeeping.
     """
 
-    def __init__(self, num_users, true_associations, contexts):
+    def __init__(self, num_users, true_associations, context_ids, context_vectors, tag_matrix=None, tag_to_idx=None,
+                 projector=None, refit_threshold=None, svd_iterations=5, encoder=None):
         self.true_associations = true_associations
-        self.contexts = contexts
         self.num_users = num_users
+        self.tag_to_idx = tag_to_idx
+        self.projector = projector
+        self.encoder = encoder
+        self.refit_threshold = refit_threshold
+        self.svd_iterations = svd_iterations
+        # tag rows of every context, as blocks of csr rows, and how many tag assignments the projector has seen
+        self.tag_blocks = [tag_matrix] if tag_matrix is not None else []
+        self.fitted_assignments = tag_matrix.nnz if tag_matrix is not None else 0
+        self.total_assignments = self.fitted_assignments
+        self.refit_thread = None
+        self.lock = threading.Lock()
+        # times the vectors of the contexts were replaced by a refit, add_contexts only appends to them
+        self.generation = 0
+        self._set_contexts(list(context_ids), context_vectors)
+
+    def _set_contexts(self, context_ids, context_vectors):
+        # vectors live in a buffer with spare rows, so that appending contexts rarely copies the matrix
+        self.context_ids = context_ids
+        self.vector_buffer = context_vectors
+        self.context_vectors = self.vector_buffer[:len(context_ids)]
+        # a context is a tuple of a context_id and its row of context_vectors
+        self.contexts = list(zip(context_ids, self.context_vectors))
         self.context_dict = {}
         for context in self.contexts:
             self.context_dict[context[0]] = context
 
+    def get_user(self):
+        return random.randrange(0, self.num_users)
+
     def get_user_and_contexts(self):
-        user = random.randrange(0, self.num_users)
-        associated_contexts = self.true_associations[user]
-        base_contexts = random.choices(self.contexts, k=24)
-        truth_context_id = random.choice(associated_contexts)
-        contexts = base_contexts + [self.context_dict[truth_context_id]]
+        with self.lock:
+            user = self.get_user()
+            associated_contexts = self.true_associations[user]
+            base_contexts = random.choices(self.contexts, k=24)
+            truth_context_id = random.choice(associated_contexts)
+            contexts = base_contexts + [self.context_dict[truth_context_id]]
         random.shuffle(contexts)
         return user, contexts
 
@@ -122,13 +190,110 @@ class TaggedUserContextManager(AbstractUserContextManager):
         else:
             return 0
 
-
-def load_data(dataset_location, four_cliques_graph_noise=0, four_cliques_epsilon=0.1, num_features=25, num_clusters=None):
+    def add_contexts(self, new_contexts):
+        """
+        Embeds new contexts, given as (context_id, list of tags) tuples, with the fitted projector (or the hashing
+        encoder) and appends them to the live contexts. Tags the projector was not fit on are ignored until it is refit.
+        Contexts whose id is already known are skipped.
+        """
+        import scipy.sparse as sp_sparse
+        with self.lock:
+            # a context appended twice would get two rows of the vectors (and of the tags refit uses)
+            new_contexts = list({context_id: context_tags for context_id, context_tags in new_contexts
+                                 if context_id not in self.context_dict}.items())
+            if not new_contexts:
+                return
+            tag_matrix = None
+            if self.encoder is not None:
+                vectors = numpy.array([self.encoder.encode(context_tags) for _, context_tags in new_contexts],
+                                      dtype=self.vector_buffer.dtype)
+            else:
+                rows, tags = [], []
+                for row, (context_id, context_tags) in enumerate(new_contexts):
+                    for tag in set(context_tags):
+                        if tag not in self.tag_to_idx:
+                            self.tag_to_idx[tag] = len(self.tag_to_idx)
+                        rows.append(row)
+                        tags.append(self.tag_to_idx[tag])
+                tag_matrix = sp_sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.float32), (rows, tags)),
+                                                  shape=(len(new_contexts), len(self.tag_to_idx)))
+                vectors = self.projector.project(tag_matrix)
+
+            num_contexts = len(self.context_ids)
+            if num_contexts + len(vectors) > len(self.vector_buffer):
+                capacity = max(2 * len(self.vector_buffer), num_contexts + len(vectors))
+                vector_buffer = numpy.empty((capacity, vectors.shape[1]), dtype=self.vector_buffer.dtype)
+                vector_buffer[:num_contexts] = self.context_vectors
+                self.vector_buffer = vector_buffer
+            self.vector_buffer[num_contexts:num_contexts + len(vectors)] = vectors
+            self.context_vectors = self.vector_buffer[:num_contexts + len(vectors)]
+            for i, (context_id, _) in enumerate(new_contexts):
+                context = (context_id, self.context_vectors[num_contexts + i])
+                self.context_ids.append(context_id)
+                self.contexts.append(context)
+                self.context_dict[context_id] = context
+            # hashed encodings are not fit, so only projected contexts count towards drift
+            if tag_matrix is not None:
+                self.tag_blocks.append(tag_matrix)
+                self.total_assignments += tag_matrix.nnz
+                if self.refit_threshold is not None and self.drift() > self.refit_threshold \
+                        and not (self.refit_thread and self.refit_thread.is_alive()):
+                    self.refit_thread = threading.Thread(target=self.refit, daemon=True)
+                    self.refit_thread.start()
+
+    def drift(self):
+        """
+        Share of the catalogue's tag assignments that the projector was not fit on
+        """
+        if not self.total_assignments:
+            return 0
+        return 1 - self.fitted_assignments / self.total_assignments
+
+    def refit(self):
+        """
+        Refits TF-IDF and SVD over every context, then swaps the new projector and vectors in
+        """
+        from ContextProjector import ContextProjector
+        with self.lock:
+            num_contexts = len(self.context_ids)
+            num_blocks = len(self.tag_blocks)
+            tag_matrix = self._stacked_tag_matrix(self.tag_blocks)
+        projector, vectors = ContextProjector.fit(tag_matrix, num_features=self.context_vectors.shape[1],
+                                                  svd_iterations=self.svd_iterations,
+                                                  dtype=self.context_vectors.dtype)
+        with self.lock:
+            # contexts added while refitting are folded in with the new projector
+            if len(self.tag_blocks) > num_blocks:
+                vectors = numpy.vstack([vectors, projector.project(self._stacked_tag_matrix(self.tag_blocks[num_blocks:]))])
+            self.projector = projector
+            self.tag_blocks = [self._stacked_tag_matrix(self.tag_blocks)]
+            self.fitted_assignments = tag_matrix.nnz
+            self._set_contexts(self.context_ids, vectors)
+            self.generation += 1
+        print("Refit context projector over {} contexts.".format(num_contexts))
+
+    def _stacked_tag_matrix(self, blocks):
+        import scipy.sparse as sp_sparse
+        num_tags = len(self.tag_to_idx)
+        # earlier blocks were built with fewer known tags, widen them to the current number of tags
+        return sp_sparse.vstack([sp_sparse.csr_matrix((block.data, block.indices, block.indptr),
+                                                      shape=(block.shape[0], num_tags)) for block in blocks]).tocsr()
+
+
+def load_data(dataset_location, four_cliques_graph_noise=0, four_cliques_epsilon=0.1, num_features=25, num_clusters=None,
+              svd_iterations=5, refit_threshold=None, context_encoder="svd", load_associations=True,
+              sparse_graph=False, dtype=numpy.float32):
     """
     :param dataset_location: location of dataset folder, or 4cliques for builtin 4cliques dataset
     :param four_cliques_graph_noise: graph noise for 4cliques
     :param four_cliques_epsilon: payoff noise for 4cliques
     :param num_features: number of features in vector
+    :param svd_iterations: power iterations of the randomized SVD used to generate context vectors
+    :param refit_threshold: share of unfitted tag assignments after which contexts added at runtime trigger a refit
+    :param context_encoder: svd (TF-IDF + SVD fit over all contexts) or hash (feature hashing + random projection)
+    :param load_associations: whether to load user_contexts.csv into memory, which the replay evaluator streams instead
+    :param sparse_graph: whether to return the graph of a dataset as a scipy CSR matrix, for agents that accept one
+    :param dtype: dtype of the graph and the context vectors (see DTYPES), which agents should be built with too
     :return: ContextManager, network graph (numpy 2-dimensional matrix of ones and zeroes)
     """
     if num_clusters:
@@ -136,27 +301,40 @@ def load_data(dataset_location, four_cliques_graph_noise=0, four_cliques_epsilon
     else:
         cluster_to_idx, idx_to_cluster = None, None
     if dataset_location != "4cliques":
-        graph, num_users = load_graph(dataset_location)
-        return TaggedUserContextManager(num_users, load_true_associations(dataset_location),
-                                        load_and_generate_contexts(dataset_location, num_features=num_features)), graph, cluster_to_idx, idx_to_cluster
+        graph, num_users = load_graph(dataset_location, sparse=sparse_graph, dtype=dtype)
+        true_associations = load_true_associations(dataset_location) if load_associations else None
+        if context_encoder == "hash":
+            context_ids, context_vectors, encoder = load_hashed_contexts(dataset_location, num_features=num_features,
+                                                                         dtype=dtype)
+            user_context_manager = TaggedUserContextManager(num_users, true_associations,
+                                                            context_ids, context_vectors, encoder=encoder)
+        elif context_encoder == "svd":
+            from ContextProjector import ContextProjector
+            context_ids, tag_matrix, tag_to_idx = load_context_tags(dataset_location)
+            projector, context_vectors = ContextProjector.fit(tag_matrix, num_features=num_features,
+                                                              svd_iterations=svd_iterations, dtype=dtype)
+            user_context_manager = TaggedUserContextManager(num_users, true_associations,
+                                                            context_ids, context_vectors, tag_matrix=tag_matrix,
+                                                            tag_to_idx=tag_to_idx, projector=projector,
+                                                            refit_threshold=refit_threshold,
+                                                            svd_iterations=svd_iterations)
+        else:
+            raise Exception("Context encoder not implemented! Try svd, hash")
+        return user_context_manager, graph, cluster_to_idx, idx_to_cluster
     else:
         threshold = 1 - four_cliques_graph_noise
-        graph = FourCliquesContextManager.generate_cliques(threshold)
-        return FourCliquesContextManager(epsilon=four_cliques_epsilon, num_features=num_features), graph, cluster_to_idx, idx_to_cluster
+        graph = FourCliquesContextManager.generate_cliques(threshold, dtype=dtype)
+        user_context_manager = FourCliquesContextManager(epsilon=four_cliques_epsilon, num_features=num_features,
+                                                         dtype=dtype)
+        return user_context_manager, graph, cluster_to_idx, idx_to_cluster
 
 
-def load_graph(dataset_location):
-    # graph is already represented as an adjacency matrix
-    f = open("{}/graph.csv".format(dataset_location), 'r')
-    rows = []
-    for line in f:
-        rows.append([int(s) for s in line.split(',')])
-    num_users = len(rows[0])
-    array = numpy.zeros((num_users, num_users))
-    for i in range(num_users):
-        for j in range(num_users):
-            array[i][j] = rows[i][j]
-    return array, num_users
+def load_graph(dataset_location, sparse=False, dtype=numpy.float32):
+    # graph is stored sparsely (see graph_io), most agents expect a dense adjacency matrix
+    import graph_io
+    graph, num_users = graph_io.load_sparse_graph(dataset_location)
+    graph = graph.astype(dtype)
+    return (graph if sparse else graph.toarray()), num_users
 
 
 def load_true_associations(dataset_location):
@@ -172,62 +350,101 @@ def load_true_associations(dataset_location):
     return user_contexts
 
 
-def load_and_generate_contexts(dataset_location, num_features=25):
+def load_context_names(dataset_location):
+    """
+    :return: dict from context id to context index, in order of appearance in context_names.csv
+    """
     # produce context indices from context names
-    context_idx = 0
     context_to_idx = {}
     contexts = open("{}/context_names.csv".format(dataset_location), 'r', encoding="utf-8")
     for line in contexts:
         context = line.split(',')[0]
         if context not in context_to_idx:
-            context_to_idx[context] = context_idx
-            context_idx += 1
+            context_to_idx[context] = len(context_to_idx)
+    return context_to_idx
+
+
+def load_context_tags(dataset_location):
+    """
+    :return: list of context ids, binary csr matrix of contexts by tags, dict from tag to column of the matrix
+    """
+    import scipy.sparse as sp_sparse
+    context_to_idx = load_context_names(dataset_location)
+    context_idx = len(context_to_idx)
 
     f = open("{}/context_tags.csv".format(dataset_location), 'r')
     tag_idx = 0
     tag_to_idx = {}
-    context_to_tags = []
+    context_indices = []
+    tag_indices = []
     # load associations between contexts and tags and index tags
     for line in f:
         context, tag = line.split(',')
+        tag = tag.strip()
         if tag not in tag_to_idx:
             tag_to_idx[tag] = tag_idx
             tag_idx += 1
         if context not in context_to_idx:
             context_to_idx[context] = context_idx
             context_idx += 1
-        context_to_tags.append((context_to_idx[context], tag_to_idx[tag]))
-    # create matrix context_num by tag_num in size whose elements are 1
+        context_indices.append(context_to_idx[context])
+        tag_indices.append(tag_to_idx[tag])
+    # create sparse matrix context_num by tag_num in size whose elements are 1
     # if the context has been associated with that tag, and zero otherwise
-    array = numpy.zeros((context_idx, tag_idx))
-
-    for context_tag_pair in context_to_tags:
-        context, tag = context_tag_pair
-        array[context][tag] = 1
-    # perform tfidf transformation
-    # value in array is decreased corresponding to the number of contexts that are tagged
-    # with a given tag, making it so that rare tags count for more. TFIDF also weights by
-    # the number of times that the tag appears with a given context, but since here all are 1
-    # this is not meaningful
-    transformer = TfidfTransformer()
-    contexts_array = transformer.fit_transform(array)
-
-    # use singular value decomposition to compress our high-dimensional sparse representation of each context
-    # into a num-features-dimensional dense representation.
-    svd = TruncatedSVD(n_components=num_features)
-    svd_contexts = svd.fit_transform(contexts_array)
-    all_contexts = []
-
-    for context_id in context_to_idx.keys():
-        # extract associated vector generated from svd for each context
-        vector = svd_contexts[context_to_idx[context_id]]
-        all_contexts.append((context_id, vector))
-        # the format for a context is a tuple of a context_id and an associated vector
-    return all_contexts
+    tag_matrix = sp_sparse.csr_matrix((numpy.ones(len(context_indices), dtype=numpy.float32),
+                                       (numpy.array(context_indices), numpy.array(tag_indices))),
+                                      shape=(context_idx, tag_idx))
+    # repeated context-tag pairs are summed when building the matrix, but should still count once
+    tag_matrix.data[:] = 1
+    # context_to_idx is ordered by index, so row i of tag_matrix belongs to the i-th context id
+    return list(context_to_idx.keys()), tag_matrix, tag_to_idx
+
+
+def load_and_generate_contexts(dataset_location, num_features=25, svd_iterations=5, dtype=numpy.float32):
+    """
+    :param svd_iterations: number of power iterations of the randomized SVD solver
+    :return: list of context ids, matrix of dtype whose rows are the corresponding context vectors
+    """
+    from ContextProjector import ContextProjector
+    context_ids, tag_matrix, _ = load_context_tags(dataset_location)
+    _, svd_contexts = ContextProjector.fit(tag_matrix, num_features=num_features, svd_iterations=svd_iterations,
+                                           dtype=dtype)
+    return context_ids, svd_contexts
+
+
+def load_hashed_contexts(dataset_location, num_features=25, dtype=numpy.float32):
+    """
+    Encodes every context with a HashingContextEncoder in a single streaming pass over context_tags.csv
+    :return: list of context ids, matrix of dtype whose rows are the corresponding context vectors, encoder
+    """
+    import scipy.sparse as sp_sparse
+    encoder = HashingContextEncoder(num_features=num_features, dtype=dtype)
+    context_to_idx = load_context_names(dataset_location)
+    vectors = numpy.zeros((max(len(context_to_idx), 1), num_features), dtype=dtype)
+    with open("{}/context_tags.csv".format(dataset_location), 'r') as f:
+        while True:
+            lines = list(islice(f, CONTEXT_CHUNK_SIZE))
+            if not lines:
+                break
+            context_indices = []
+            tag_rows = []
+            for line in lines:
+                context, tag = line.split(',')
+                if context not in context_to_idx:
+                    context_to_idx[context] = len(context_to_idx)
+                context_indices.append(context_to_idx[context])
+                tag_rows.append(encoder.tag_row(tag.strip()))
+            if len(context_to_idx) > len(vectors):
+                vectors = numpy.concatenate([vectors, numpy.zeros((len(context_to_idx), num_features), dtype)])
+            # add every tag's encoding to its context, as a sparse contexts x tags times dense tags x features product
+            chunk = sp_sparse.csr_matrix((numpy.ones(len(tag_rows), dtype=dtype), (context_indices, tag_rows)),
+                                         shape=(len(vectors), len(encoder.tag_table)))
+            vectors += chunk @ encoder.tag_table
+    return list(context_to_idx.keys()), normalize_rows(vectors[:len(context_to_idx)]), encoder
 
 
 def load_clusters(dataset_location, num_clusters):
-    if num_clusters not in [5, 10, 20, 50, 100, 200]:
+    if num_clusters not in CLUSTER_COUNTS:
         raise Exception("Invalid cluster number!")
     filename = "{}/clustered_graph.part.{}".format(dataset_location, num_clusters)
     idx_to_cluster = {} 
@@ -243,19 +460,70 @@ def load_clusters(dataset_location, num_clusters):
     return cluster_to_idx, idx_to_cluster
 
 
-def load_agent(algorithm_name, num_features, alpha, graph, cluster_data):
-    if algorithm_name == "dummy":
-        return DummyAgent()
-    elif algorithm_name == "linucb":
-        return LinUCBAgent(num_features, alpha)
-    elif algorithm_name == "linucbsin":
-        return LinUCBAgent(num_features, alpha, True)
-    elif algorithm_name == "goblin":
-        return GOBLinAgent(graph, len(graph), alpha=alpha, vector_size=num_features)
-    elif algorithm_name == "block":
-        return BlockAgent(graph, len(graph), cluster_data, alpha=alpha,  vector_size=num_features)
-    elif algorithm_name == "macro":
-        return MacroAgent(graph, len(graph), cluster_data, alpha=alpha, vector_size=num_features)
-    else:
-        raise Exception("Algorithm not implemented! Try linucb, linucbsin, goblin")
-
+def agent_class(class_name):
+    """
+    Agent class from the module of the same name, which is only imported the first time it is asked for
+    """
+    return getattr(importlib.import_module(class_name), class_name)
+
+
+def phi_cache_bytes(args):
+    return PHI_CACHE_BYTES if args["cache_phis"] else 0
+
+
+def load_block_agent(args):
+    if args["num_workers"]:
+        # clusters spread over worker processes
+        return agent_class("ShardedBlockAgent")(args["graph"], len(args["graph"]), args["cluster_data"],
+                                                alpha=args["alpha"], vector_size=args["num_features"],
+                                                num_workers=args["num_workers"], memory_budget=args["memory_budget"],
+                                                phi_cache_bytes=phi_cache_bytes(args), dtype=args["dtype"])
+    return agent_class("BlockAgent")(args["graph"], len(args["graph"]), args["cluster_data"], alpha=args["alpha"],
+                                     vector_size=args["num_features"], memory_budget=args["memory_budget"],
+                                     phi_cache_bytes=phi_cache_bytes(args), dtype=args["dtype"])
+
+
+CG_TOL = 1e-4  # relative residual of the conjugate gradient solves of goblinmf, linucbdiag and linucbfd
+SKETCH_RANK = 5  # rank of the Frequent Directions sketch of linucbfd, which keeps twice as many rows per user
+
+
+# algorithm name -> function building the agent from the arguments of load_agent, so that running one algorithm
+# does not import the modules (and dependencies) of all the others
+AGENTS = {
+    "dummy": lambda args: agent_class("DummyAgent")(),
+    "linucb": lambda args: agent_class("LinUCBAgent")(args["num_features"], args["alpha"],
+                                                      state_path=args["state_path"], dtype=args["dtype"]),
+    "linucbsin": lambda args: agent_class("LinUCBAgent")(args["num_features"], args["alpha"], True,
+                                                         state_path=args["state_path"], dtype=args["dtype"]),
+    "linucbdiag": lambda args: agent_class("SketchedLinUCBAgent")(args["num_features"], args["alpha"], "diag",
+                                                                  state_path=args["state_path"], tol=args["cg_tol"],
+                                                                  dtype=args["dtype"]),
+    "linucbfd": lambda args: agent_class("SketchedLinUCBAgent")(args["num_features"], args["alpha"], "fd",
+                                                                args["sketch_rank"], state_path=args["state_path"],
+                                                                tol=args["cg_tol"], dtype=args["dtype"]),
+    "goblin": lambda args: agent_class("GOBLinAgent")(args["graph"], len(args["graph"]), alpha=args["alpha"],
+                                                      vector_size=args["num_features"],
+                                                      phi_cache_bytes=phi_cache_bytes(args), dtype=args["dtype"]),
+    "goblinmf": lambda args: agent_class("MatrixFreeGOBLinAgent")(args["graph"], args["graph"].shape[0],
+                                                                  alpha=args["alpha"], vector_size=args["num_features"],
+                                                                  tol=args["cg_tol"], dtype=args["dtype"]),
+    "block": load_block_agent,
+    "macro": lambda args: agent_class("MacroAgent")(args["graph"], len(args["graph"]), args["cluster_data"],
+                                                    alpha=args["alpha"], vector_size=args["num_features"],
+                                                    phi_cache_bytes=phi_cache_bytes(args), dtype=args["dtype"]),
+}
+
+
+def load_agent(algorithm_name, num_features, alpha, graph, cluster_data, num_workers=None, memory_budget=None,
+               state_path=None, sketch_rank=SKETCH_RANK, cg_tol=CG_TOL, cache_phis=True, dtype=numpy.float32):
+    """
+    :param cache_phis: whether graph agents keep the phis of contexts for reuse, which is of no use when context ids
+    never repeat (see AbstractUserContextManager.UNIQUE_CONTEXT_IDS)
+    :param dtype: dtype of the agent's state, which should be that of the context vectors (see load_data)
+    """
+    if algorithm_name not in AGENTS:
+        raise Exception("Algorithm not implemented! Try {}".format(", ".join(AGENTS.keys())))
+    return AGENTS[algorithm_name](dict(num_features=num_features, alpha=alpha, graph=graph, cluster_data=cluster_data,
+                                       num_workers=num_workers, memory_budget=memory_budget,
+                                       state_path=state_path, sketch_rank=sketch_rank,
+                                       cg_tol=cg_tol, cache_phis=cache_phis, dtype=dtype))
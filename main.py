@@ -1,22 +1,45 @@
 import sys
-import matplotlib.pyplot as plt
 import load
+import planner
+from CandidateIndex import ShortlistUserContextManager
+from ReplayEvaluator import ReplayEvaluator
 import getopt
-from tqdm import tqdm
 import random
 
+SHARDED_ROUND_SIZE = 16  # users a sharded block agent (--workers) chooses for at once, see simulate
+
 
 def parse_command_line_args(args):
     """
     Command line options:
     -d: dataset location (included are delicious-processed, lastfm-processed, 4cliques)
-    -a: algorithm name (linucb, linucbsin, goblin)
+    -a: algorithm name (linucb, linucbsin, linucbdiag, linucbfd, goblin, goblinmf), or several separated by commas
+    with --replay
     -t: time steps (typically 10000)
     -f: output_filename (for output -- csv)
     -p: alpha value (typically 0.1)
     -c: number of clusters
+    -e: context encoder (svd, hash)
     --4cliques-epsilon: 4cliques payoff noise
     --4cliques-graph-noise: 4cliques graph noise
+    --svd-iterations: power iterations of the randomized SVD generating context vectors (typically 5)
+    --candidates: choose among this many candidates retrieved from the whole catalogue (tagged datasets only)
+    --candidate-index: index used to retrieve candidates (exact, lsh)
+    --exploration-margin: weight of context norm added to retrieval scores (typically 0.1)
+    --workers: with -a block, number of worker processes the clusters are spread over. The simulation then serves
+    users in rounds of SHARDED_ROUND_SIZE, choosing for a whole round before applying its updates
+    --memory-budget: with -a block, megabytes of cluster state kept in memory (per worker), the rest is spilled to disk
+    --replicas: with -d 4cliques and -a linucb or linucbsin, number of independent runs simulated in lockstep
+    --max-memory: megabytes an agent's planned peak memory may reach before the run is refused (physical memory)
+    --user-state: with -a linucb, linucbsin, linucbdiag or linucbfd, path prefix of memory-mapped files holding the
+    users' state
+    --sketch-rank: with -a linucbfd, rank of the Frequent Directions sketch kept per user, from 1 to
+    half the number of features (typically 5)
+    --cg-tol: with -a goblinmf, linucbdiag or linucbfd, relative residual of its conjugate gradient solves
+    (typically 1e-4)
+    --dtype: floating point type of the graph, the context vectors and the agents' state (float32, float64)
+    --replay: evaluate offline by replaying the logged user_contexts.csv (up to -t events) instead of simulating
+    (--workers, --memory-budget, --user-state and --candidates do not apply to replay)
     """
     # - further arguments
     argument_list = args[1:]
@@ -28,12 +51,31 @@ def parse_command_line_args(args):
         'f': "results.csv",  # file out
         'p': 0.1,  # alpha
         'c': None, # number of clusters
+        'e': "svd",  # context encoder
         '4cliques-epsilon': 0.1,  # 4cliques payoff noise
-        '4cliques-graph-noise': 0  # 4cliques graph noise
+        '4cliques-graph-noise': 0,  # 4cliques graph noise
+        'svd-iterations': 5,  # randomized SVD power iterations
+        'candidates': None,  # number of candidates retrieved from the catalogue
+        'candidate-index': "exact",  # candidate retrieval index
+        'exploration-margin': 0.1,  # retrieval exploration margin
+        'workers': None,  # worker processes of a sharded block agent
+        'memory-budget': None,  # megabytes of block agent cluster state in memory
+        'replicas': None,  # independent runs simulated in lockstep
+        'max-memory': None,  # megabytes an agent may plan to use
+        'user-state': None,  # path prefix of memory-mapped linucb user state
+        'sketch-rank': load.SKETCH_RANK,  # rank of linucbfd sketches
+        'cg-tol': load.CG_TOL,  # conjugate gradient tolerance of goblinmf, linucbdiag and linucbfd
+        'dtype': load.DTYPES[0],  # floating point type
+        'replay': False  # offline replay evaluation
     }
-    unix_options = "d:a:t:f:p:c:"
+    unix_options = "d:a:t:f:p:c:e:"
     try:
-        arguments = getopt.getopt(argument_list, unix_options, ['4cliques-epsilon=', '4cliques-graph-noise='])[0]
+        arguments = getopt.getopt(argument_list, unix_options, ['4cliques-epsilon=', '4cliques-graph-noise=',
+                                                                'svd-iterations=', 'candidates=',
+                                                                'candidate-index=', 'exploration-margin=',
+                                                                'workers=', 'memory-budget=', 'replicas=',
+                                                                'max-memory=', 'user-state=', 'sketch-rank=',
+                                                                'cg-tol=', 'dtype=', 'replay'])[0]
     except getopt.error as err:
         # output error, and return with an error code
         print(str(err))
@@ -51,15 +93,154 @@ def parse_command_line_args(args):
             arg_options['p'] = float(cur_arg[1])
         elif '-c' in cur_arg:
             arg_options['c'] = int(cur_arg[1])
+        elif '-e' in cur_arg:
+            arg_options['e'] = cur_arg[1].lower()
         elif '--4cliques-epsilon' in cur_arg:
             arg_options['4cliques-epsilon'] = float(cur_arg[1])
         elif '--4cliques-graph-noise' in cur_arg:
             arg_options['4cliques-graph-noise'] = float(cur_arg[1])
+        elif '--svd-iterations' in cur_arg:
+            arg_options['svd-iterations'] = int(cur_arg[1])
+        elif '--candidates' in cur_arg:
+            arg_options['candidates'] = int(cur_arg[1])
+        elif '--candidate-index' in cur_arg:
+            arg_options['candidate-index'] = cur_arg[1].lower()
+        elif '--exploration-margin' in cur_arg:
+            arg_options['exploration-margin'] = float(cur_arg[1])
+        elif '--workers' in cur_arg:
+            arg_options['workers'] = int(cur_arg[1])
+        elif '--memory-budget' in cur_arg:
+            arg_options['memory-budget'] = float(cur_arg[1])
+        elif '--replicas' in cur_arg:
+            arg_options['replicas'] = int(cur_arg[1])
+        elif '--max-memory' in cur_arg:
+            arg_options['max-memory'] = float(cur_arg[1])
+        elif '--user-state' in cur_arg:
+            arg_options['user-state'] = cur_arg[1]
+        elif '--sketch-rank' in cur_arg:
+            arg_options['sketch-rank'] = int(cur_arg[1])
+        elif '--cg-tol' in cur_arg:
+            arg_options['cg-tol'] = float(cur_arg[1])
+        elif '--dtype' in cur_arg:
+            arg_options['dtype'] = cur_arg[1].lower()
+        elif '--replay' in cur_arg:
+            arg_options['replay'] = True
         else:
             raise Exception("Error! Argument {} not found in {}.".format(cur_arg, list(arg_options.keys())))
     return arg_options
 
 
+def simulate(user_context_manager, agent, normalizing_agent, time_steps, progress=True, round_size=1):
+    """
+    Runs agent for time_steps steps, and returns its cumulative payoff at every step relative to normalizing_agent
+    :param round_size: steps served per round by an agent with choose_batch (ShardedBlockAgent), which chooses for
+    all the users of a round at once, so that users in different shards are served in parallel. Their updates are
+    applied after the round, so a choice does not see the payoffs of the earlier steps of its round
+    """
+    if not hasattr(agent, "choose_batch"):
+        round_size = 1
+    # The list of results
+    results = []
+    rounds = range(0, time_steps, round_size)
+    if progress:
+        # tqdm creates the nice progress bars! (imported here, as it is slow to import and only needed here)
+        from tqdm import tqdm
+        rounds = tqdm(rounds)
+    for round_start in rounds:
+        requests = [user_context_manager.get_user_and_contexts() + (step,)
+                    for step in range(round_start, min(round_start + round_size, time_steps))]
+        if round_size > 1:
+            chosen_contexts = agent.choose_batch(requests)
+        else:
+            chosen_contexts = [agent.choose(*request) for request in requests]
+        for (user_id, contexts, step), chosen_context in zip(requests, chosen_contexts):
+            payoff = user_context_manager.get_payoff(user_id, chosen_context)
+            agent.update(payoff, chosen_context, user_id)
+            # normalize with random choice
+            normalizing_chosen_context = normalizing_agent.choose(user_id, contexts, step)
+            payoff -= user_context_manager.get_payoff(user_id, normalizing_chosen_context)
+            if step != 0:
+                results.append(results[step - 1] + payoff)
+            else:
+                results.append(payoff)
+
+    return results
+
+
+def simulate_replicas(replicas, agent, time_steps, progress=True):
+    """
+    Runs the replicas of a ReplicatedLinUCBAgent in lockstep for time_steps steps
+    :return: (S, T) array of every replica's cumulative payoff at every step relative to random choice
+    """
+    import numpy as np
+    payoffs = np.zeros((replicas.num_replicas, time_steps))
+    replica_indices = np.arange(replicas.num_replicas)
+    steps = range(time_steps)
+    if progress:
+        from tqdm import tqdm
+        steps = tqdm(steps)
+    for step in steps:
+        user_ids, contexts = replicas.get_users_and_contexts()
+        chosen_vectors = contexts[replica_indices, agent.choose(user_ids, contexts, step)]
+        payoff = replicas.get_payoffs(user_ids, chosen_vectors)
+        agent.update(payoff, chosen_vectors, user_ids)
+        # normalize with random choice
+        random_vectors = contexts[replica_indices, replicas.rng.integers(0, contexts.shape[1], replicas.num_replicas)]
+        payoffs[:, step] = payoff - replicas.get_payoffs(user_ids, random_vectors)
+    return np.cumsum(payoffs, axis=1)
+
+
+def run_replicas(num_replicas, algorithm_name, time_steps, output_filename, num_features, alpha,
+                 four_cliques_epsilon, dtype):
+    """
+    Runs num_replicas independent replicas of LinUCB on 4cliques in one process, plots their mean and spread,
+    and writes a csv with one line per step and one column per replica
+    """
+    if algorithm_name not in ["linucb", "linucbsin"]:
+        raise Exception("Replicated simulation not implemented! Try linucb, linucbsin")
+    from ReplicatedLinUCBAgent import ReplicatedLinUCBAgent
+    replicas = load.FourCliquesReplicas(num_replicas, epsilon=four_cliques_epsilon, num_features=num_features,
+                                        dtype=dtype)
+    agent = ReplicatedLinUCBAgent(num_replicas, replicas.num_users, num_features, alpha,
+                                  is_sin=algorithm_name == "linucbsin", dtype=dtype)
+    results = simulate_replicas(replicas, agent, time_steps)
+
+    import matplotlib.pyplot as plt
+    plt.plot(results.mean(axis=0))
+    plt.fill_between(range(time_steps), results.min(axis=0), results.max(axis=0), alpha=0.3)
+    plt.ylabel('Cumulative payoff')
+    plt.show()
+
+    with open(output_filename, "w") as outfile:
+        for step_results in results.T:
+            outfile.write(",".join('{0}'.format(num) for num in step_results))
+            outfile.write("\n")
+
+
+def replay_agents(dataset_location, user_context_manager, algorithm_names, max_events, output_filename,
+                  num_features, alpha, network, cluster_data, sketch_rank, cg_tol, dtype):
+    """
+    Evaluates every named agent offline by replaying the logged user_contexts.csv, and writes a summary csv
+    """
+    if dataset_location == "4cliques":
+        raise Exception("Replay needs logged user contexts, which 4cliques does not have")
+    # catalogue contexts recur from event to event, so the phis of graph agents are cached
+    agents = {name: load.load_agent(name, num_features=num_features, alpha=alpha, graph=network,
+                                    cluster_data=cluster_data, sketch_rank=sketch_rank, cg_tol=cg_tol,
+                                    cache_phis=not user_context_manager.UNIQUE_CONTEXT_IDS, dtype=dtype)
+              for name in algorithm_names}
+    print("Loaded agents.")
+    evaluator = ReplayEvaluator("{}/user_contexts.csv".format(dataset_location), user_context_manager.contexts,
+                                agents)
+    results = evaluator.run(max_events=max_events)
+    columns = ["events", "matched", "payoff", "match_rate", "payoff_per_match"]
+    with open(output_filename, "w") as outfile:
+        outfile.write(",".join(["algorithm"] + columns) + "\n")
+        for name, result in results.items():
+            print("{}: {}".format(name, ", ".join("{} {}".format(column, result[column]) for column in columns)))
+            outfile.write(",".join([name] + [str(result[column]) for column in columns]) + "\n")
+
+
 def main():
     """
     Runs one of two multi-armed bandit learners, GOB.Lin or LinUCB, in order to attempt to learn
@@ -80,8 +261,22 @@ def main():
     output_filename = args['f']
     alpha = args['p']
     num_clusters = args['c']
+    context_encoder = args['e']
     four_cliques_epsilon = args['4cliques-epsilon']
     four_cliques_graph_noise = args['4cliques-graph-noise']
+    svd_iterations = args['svd-iterations']
+    num_candidates = args['candidates']
+    candidate_index = args['candidate-index']
+    exploration_margin = args['exploration-margin']
+    num_workers = args['workers']
+    memory_budget = args['memory-budget']
+    num_replicas = args['replicas']
+    max_memory = args['max-memory']
+    state_path = args['user-state']
+    sketch_rank = args['sketch-rank']
+    cg_tol = args['cg-tol']
+    dtype = args['dtype']
+    replay = args['replay']
     # debug string to show selected arguments
     argument_detail_string = '''
     -a (algorithm): {}
@@ -90,11 +285,48 @@ def main():
     -f (output filename): {}
     -p (learning rate/alpha): {}
     -c (number of clusters): {}
+    -e (context encoder): {}
     --4cliques-epsilon (payoff noise, 4cliques generated dataset): {}
     --4cliques-graph-noise (graph noise for 4cliques, determines flipped edges): {}
+    --svd-iterations (randomized SVD power iterations): {}
+    --candidates (candidates retrieved from the catalogue): {}
+    --candidate-index (candidate retrieval index): {}
+    --exploration-margin (retrieval exploration margin): {}
+    --workers (worker processes of a sharded block agent): {}
+    --memory-budget (megabytes of block agent cluster state in memory): {}
+    --replicas (independent runs simulated in lockstep): {}
+    --max-memory (megabytes an agent may plan to use): {}
+    --user-state (memory-mapped linucb user state): {}
+    --sketch-rank (rank of linucbfd sketches): {}
+    --cg-tol (conjugate gradient tolerance): {}
+    --dtype (floating point type): {}
+    --replay (offline replay evaluation): {}
     '''.format(algorithm_name, dataset_location, time_steps, output_filename, alpha,
-               num_clusters, four_cliques_epsilon, four_cliques_graph_noise)
+               num_clusters, context_encoder, four_cliques_epsilon, four_cliques_graph_noise, svd_iterations,
+               num_candidates, candidate_index, exploration_margin, num_workers, memory_budget,
+               num_replicas, max_memory, state_path, sketch_rank, cg_tol, dtype, replay)
     print(argument_detail_string)
+    if dtype not in load.DTYPES:
+        raise Exception("Dtype {} not implemented! Try {}".format(dtype, ", ".join(load.DTYPES)))
+    if num_replicas:
+        if dataset_location != "4cliques":
+            raise Exception("Replicated simulation not implemented for {}! Try 4cliques".format(dataset_location))
+        run_replicas(num_replicas, algorithm_name, time_steps, output_filename, NUM_FEATURES, alpha,
+                     four_cliques_epsilon, dtype)
+        return
+    if replay:
+        unsupported = [option for option, value in [("--workers", num_workers), ("--memory-budget", memory_budget),
+                                                    ("--user-state", state_path), ("--candidates", num_candidates)]
+                       if value]
+        if unsupported:
+            raise Exception("Replay not implemented with {}! Try without".format(", ".join(unsupported)))
+    memory_budget = memory_budget * 2 ** 20 if memory_budget else None
+    # estimate what the agents will need before loading anything, and stop here if they would not fit
+    algorithm_names = algorithm_name.split(',') if replay else [algorithm_name]
+    for name in algorithm_names:
+        planner.plan_agent(name, dataset_location, NUM_FEATURES, num_clusters=num_clusters, num_workers=num_workers,
+                           memory_budget=memory_budget, max_memory=max_memory * 2 ** 20 if max_memory else None,
+                           sketch_rank=sketch_rank, num_steps=time_steps, dtype=dtype)
 
     # user_context_manager provides a means of obtaining users and associated contexts to choose from for that
     # user, with the goal of choosing the most preferred context.
@@ -103,36 +335,47 @@ def main():
                                                    four_cliques_epsilon=four_cliques_epsilon,
                                                    four_cliques_graph_noise=four_cliques_graph_noise,
                                                    num_features=NUM_FEATURES,
-                                                   num_clusters=num_clusters)
+                                                   num_clusters=num_clusters,
+                                                   svd_iterations=svd_iterations,
+                                                   context_encoder=context_encoder,
+                                                   load_associations=not replay,
+                                                   # only goblinmf takes the graph as a sparse matrix
+                                                   sparse_graph=set(algorithm_names) == {"goblinmf"},
+                                                   dtype=dtype)
     print("Loaded data.")
     if cluster_to_idx and idx_to_cluster:
         cluster_data = (cluster_to_idx, idx_to_cluster)
     else:
         cluster_data = None
+    if replay:
+        replay_agents(dataset_location, user_context_manager, algorithm_name.split(','), time_steps, output_filename,
+                      NUM_FEATURES, alpha, network, cluster_data, sketch_rank, cg_tol, dtype)
+        return
     agent = load.load_agent(algorithm_name, num_features=NUM_FEATURES, alpha=alpha, graph=network,
-                            cluster_data=cluster_data)
+                            cluster_data=cluster_data, num_workers=num_workers,
+                            memory_budget=memory_budget, state_path=state_path, sketch_rank=sketch_rank,
+                            cg_tol=cg_tol, cache_phis=not user_context_manager.UNIQUE_CONTEXT_IDS, dtype=dtype)
     normalizing_agent = load.load_agent('dummy', num_features=NUM_FEATURES, alpha=alpha, graph=network,
                             cluster_data=cluster_data)
     print("Loaded agent.")
+    if num_candidates:
+        if dataset_location == "4cliques":
+            raise Exception("Candidate retrieval needs a catalogue of contexts, which 4cliques does not have")
+        # choose from a shortlist of the whole catalogue instead of a random collection of contexts
+        user_context_manager = ShortlistUserContextManager(user_context_manager, agent, index_type=candidate_index,
+                                                           num_candidates=num_candidates, margin=exploration_margin)
 
-    # The list of results
-    results = []
-    # tqdm creates the nice progress bars!
-    for step in tqdm(range(time_steps)):
-        user_id, contexts = user_context_manager.get_user_and_contexts()
-        chosen_context = agent.choose(user_id, contexts, step)
-        payoff = user_context_manager.get_payoff(user_id, chosen_context)
-        agent.update(payoff, chosen_context, user_id)
-        # normalize with random choice
-        normalizing_chosen_context = normalizing_agent.choose(user_id, contexts, step)
-        payoff -= user_context_manager.get_payoff(user_id, normalizing_chosen_context)
-        if step != 0:
-            results.append(results[step - 1] + payoff)
-        else:
-            results.append(payoff)
+    results = simulate(user_context_manager, agent, normalizing_agent, time_steps,
+                       round_size=SHARDED_ROUND_SIZE if num_workers else 1)
+    if hasattr(agent, "close"):
+        agent.close()
+    if hasattr(agent, "phi_cache"):
+        print("Phi cache: {} hits, {} misses ({:.1%} hit rate)".format(agent.phi_cache.hits, agent.phi_cache.misses,
+                                                                       agent.phi_cache.hit_rate()))
 
     # Two options for data visualization:
     # Matplotlib (immediate visualization) and csv export (for later use)
+    import matplotlib.pyplot as plt
     plt.plot(results)
     plt.ylabel('Cumulative payoff')
     plt.show()
@@ -0,0 +1,85 @@
+'''
+Incremental preprocessing pipelines for the datasets.
+
+A pipeline is a list of stages, each of which reads some input files and writes some output files.
+After a stage runs, the hashes of its inputs are recorded in a state file next to the outputs.
+On the next run a stage is skipped if its inputs hash the same as they did then and its outputs
+still exist, so changing one raw file only rebuilds the outputs that depend on it.
+'''
+import hashlib
+import json
+import os
+from itertools import islice
+
+STATE_FILENAME = "pipeline_state.json"
+CHUNK_SIZE = 1 << 16  # lines per chunk
+HASH_BLOCK_SIZE = 1 << 20  # bytes per read when hashing
+
+
+class Stage:
+    """
+    A named step of a pipeline. run is called without arguments and must write every file in outputs.
+    """
+    def __init__(self, name, inputs, outputs, run):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, skip_header=False, encoding=None):
+    """
+    Yields the lines of a file in lists of at most chunk_size lines
+    """
+    with open(path, "r", encoding=encoding) as f:
+        if skip_header:
+            f.readline()
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                break
+            yield lines
+
+
+def run_pipeline(stages, state_path, force=False):
+    """
+    Runs every stage whose inputs changed since its last run, or whose outputs are missing. Stages with missing
+    inputs are skipped, as are the stages that need their outputs, unless those were written by an earlier run.
+    :param force: run every stage regardless
+    """
+    state_dir = os.path.dirname(os.path.abspath(state_path))
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    for stage in stages:
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing:
+            print("{}: missing {}, skipped.".format(stage.name, ", ".join(os.path.relpath(path) for path in missing)))
+            continue
+        # inputs are hashed only now, since they may be the outputs of an earlier stage
+        input_hashes = {os.path.relpath(path, state_dir): hash_file(path) for path in stage.inputs}
+        up_to_date = state.get(stage.name) == input_hashes and all(os.path.exists(path) for path in stage.outputs)
+        if up_to_date and not force:
+            print("{}: inputs unchanged, skipped.".format(stage.name))
+            continue
+        print("{}: running.".format(stage.name))
+        # forget the stage until it has finished, so that an interrupted stage is never considered up to date
+        state.pop(stage.name, None)
+        _write_state(state, state_path)
+        stage.run()
+        state[stage.name] = input_hashes
+        _write_state(state, state_path)
+
+
+def _write_state(state, state_path):
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
@@ -0,0 +1,269 @@
+import os
+import numpy
+import load
+
+'''
+Estimates the peak memory and per-step floating point operations of an agent before anything is loaded, from the
+number of users, the cluster sizes and num_features, and refuses plans that exceed a memory limit.
+The counts follow the dense code paths of the agents: n users of d features make (n * d) x (n * d) matrices of the
+dtype (see load.DTYPES).
+'''
+
+COMPLEX128_BYTES = 16
+INDEX_BYTES = 4  # int32 column index of a CSR matrix entry
+FOUR_CLIQUES_USERS = load.FourCliquesContextManager.NUM_CLIQUES * load.FourCliquesContextManager.CLIQUE_SIZE
+
+
+def physical_memory():
+    """
+    Bytes of physical memory of this machine, None where unknown
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return "{:.1f} {}".format(num_bytes, unit)
+        num_bytes /= 1024
+    return "{:.1f} TB".format(num_bytes)
+
+
+def _goblin_estimate(num_users, num_features, num_contexts, item_bytes):
+    # bias, m, m_inverse, a_kron and a_kron_exp of one (n * d) x (n * d) problem
+    size = num_users * num_features
+    state = 4 * size ** 2 * item_bytes
+    # fractional_matrix_power works on a complex Schur decomposition of a_kron, with a few matrices of temporaries
+    construction = 3 * size ** 2 * COMPLEX128_BYTES
+    # choose makes a long vector per context, updates are in place (see sherman_morrison)
+    step = num_contexts * size * item_bytes
+    # choose: the user's columns of a_kron_exp times every context (when its phi is not cached), a quadratic form
+    # with m_inverse for every context, plus w_t. update: rank-1 updates of m and m_inverse, and m_inverse times phi
+    flops = 2 * num_contexts * size * num_features + (2 * num_contexts + 2) * size ** 2 + 6 * size ** 2
+    return state, max(construction, step), flops, 25 * size ** 3
+
+
+def _cluster_estimate(cluster_size, num_features, num_contexts, keep_full_matrices, item_bytes):
+    # as _goblin_estimate for one cluster, but the power is taken of the n x n matrix (see BlockAgent.ClusterInfo)
+    size = cluster_size * num_features
+    state = (4 if keep_full_matrices else 2) * size ** 2 * item_bytes
+    step = num_contexts * size * item_bytes
+    flops = 2 * num_contexts * size * num_features + (2 * num_contexts + 2) * size ** 2 + \
+        (6 if keep_full_matrices else 4) * size ** 2
+    return state, step, flops, 25 * cluster_size ** 3 + size ** 2
+
+
+def estimate_agent(algorithm_name, num_users, num_features, cluster_sizes=None, num_contexts=25, num_workers=None,
+                   memory_budget=None, sketch_rank=load.SKETCH_RANK, num_steps=10000, num_edges=None,
+                   dtype=numpy.float32):
+    """
+    :param cluster_sizes: list of the number of users of every cluster, for block and macro
+    :param sketch_rank: rank of the sketches of linucbfd, see SketchedLinUCBAgent
+    :param num_steps: time steps, for goblinmf, linucbdiag and linucbfd whose state grows with every update
+    :param num_edges: nonzero entries of the adjacency matrix, for goblinmf (a dense estimate if None)
+    :param dtype: dtype of the graph and the agent's state
+    :param memory_budget: bytes of cluster state a block agent keeps in memory (per worker), see BlockAgent
+    :return: dict of state (bytes kept for the whole run), peak (bytes, state and temporaries), step_flops
+    (expected floating point operations of a choose and update), construction_flops, processes, and
+    description of the construction path
+    """
+    item_bytes = numpy.dtype(dtype).itemsize
+    # load_graph returns a dense adjacency matrix of the dtype
+    graph = num_users ** 2 * item_bytes
+    plan = {"algorithm": algorithm_name, "processes": 1, "construction_flops": 0}
+    if algorithm_name == "dummy":
+        plan.update(state=0, peak=0, step_flops=0, description="random choice")
+    elif algorithm_name in ["linucb", "linucbsin"]:
+        users = 1 if algorithm_name == "linucbsin" else num_users
+        # m inverse and b of every user seen, see UserStateStore
+        state = users * (num_features ** 2 + num_features) * item_bytes
+        plan.update(state=state, peak=state, step_flops=(2 * num_contexts + 8) * num_features ** 2,
+                    description="{} d x d matrices".format(users))
+    elif algorithm_name in ["linucbdiag", "linucbfd"]:
+        # b and theta of every user seen, and the chosen context vectors theta is solved over, in arrays of up to
+        # twice their length
+        history = 2 * num_steps * num_features * item_bytes
+        state = num_users * 2 * num_features * item_bytes + history
+        # update: conjugate gradient for theta over the user's history, assuming d iterations over num_steps /
+        # num_users rows
+        theta_flops = num_features * 4 * num_steps / max(num_users, 1) * num_features
+        if algorithm_name == "linucbdiag":
+            # and the diagonal of m
+            state += num_users * num_features * item_bytes
+            plan.update(state=state, peak=state, step_flops=(4 * num_contexts + 6) * num_features + theta_flops,
+                        description="{} diagonals and {} history rows".format(num_users, num_steps))
+        else:
+            # and 2 * rank sketch rows and the shrinkage
+            rows = 2 * sketch_rank
+            state += num_users * (rows * num_features + 1) * item_bytes
+            # choose: sketch times every context, a rows x rows solve, and the projections back; update: an svd of
+            # the sketch once every rank updates
+            flops = 4 * num_contexts * rows * num_features + 2 * rows ** 3 + \
+                4 * rows ** 2 * num_features / sketch_rank + theta_flops
+            plan.update(state=state, peak=state + num_contexts * rows * item_bytes, step_flops=flops,
+                        description="{} sketches of {} x {} and {} history rows".format(num_users, rows, num_features,
+                                                                                        num_steps))
+    elif algorithm_name == "goblin":
+        state, temporaries, flops, construction_flops = _goblin_estimate(num_users, num_features, num_contexts,
+                                                                         item_bytes)
+        plan.update(state=state + graph, peak=state + graph + temporaries, step_flops=flops,
+                    construction_flops=construction_flops,
+                    description="one {0} x {0} problem".format(num_users * num_features))
+    elif algorithm_name == "goblinmf":
+        size = num_users * num_features
+        num_edges = num_users ** 2 if num_edges is None else num_edges
+        # graph and a + laplacian in CSR, the history of chosen long vectors (d entries each), bias, w and the
+        # preconditioner
+        entry_bytes = item_bytes + INDEX_BYTES
+        state = 2 * (num_edges + num_users) * entry_bytes + num_steps * num_features * entry_bytes + \
+            3 * size * item_bytes
+        # choose holds the right-hand sides and starting points of a conjugate gradient solve, and the solve five more
+        # (n * d) x (contexts + 1) matrices
+        temporaries = 7 * size * (num_contexts + 1) * item_bytes
+        # every iteration applies a and the history to all columns, assuming some tens of iterations per solve
+        flops = 20 * 2 * (num_contexts + 1) * ((num_edges + num_users) * num_features + 2 * num_steps * num_features)
+        plan.update(state=state, peak=state + temporaries, step_flops=flops,
+                    description="matrix-free over {} edges and {} steps".format(num_edges, num_steps))
+    elif algorithm_name == "macro":
+        num_clusters = len(cluster_sizes)
+        state, temporaries, flops, construction_flops = _goblin_estimate(num_clusters, num_features, num_contexts,
+                                                                         item_bytes)
+        plan.update(state=state + graph, peak=state + graph + temporaries, step_flops=flops,
+                    construction_flops=construction_flops + num_users ** 2,
+                    description="goblin over {} clusters".format(num_clusters))
+    elif algorithm_name == "block":
+        keep_full_matrices = memory_budget is None
+        estimates = [_cluster_estimate(size, num_features, num_contexts, keep_full_matrices, item_bytes)
+                     for size in cluster_sizes]
+        if num_workers:
+            # the most loaded worker, see ShardedBlockAgent
+            from ShardedBlockAgent import balance_clusters
+            sizes = dict(enumerate(cluster_sizes))
+            shards = balance_clusters({cluster: range(size) for cluster, size in sizes.items()},
+                                      min(num_workers, len(sizes)))
+            shard_states = [sum(estimates[cluster][0] for cluster in shard) for shard in shards]
+            shard_temporaries = [max([estimates[cluster][1] for cluster in shard], default=0) for shard in shards]
+            state = max(shard_states)
+            temporaries = max(shard_temporaries)
+            plan["processes"] = len(shards)
+            description = "{} clusters on {} workers".format(len(cluster_sizes), len(shards))
+        else:
+            state = sum(estimate[0] for estimate in estimates)
+            temporaries = max(estimate[1] for estimate in estimates)
+            description = "{} clusters".format(len(cluster_sizes))
+        if memory_budget is not None:
+            # clusters beyond the budget are spilled, but the cluster in use is always in memory
+            state = min(state, max(memory_budget, max(estimate[0] for estimate in estimates)))
+            description += ", spilling beyond {}".format(format_bytes(memory_budget))
+        # a user is in a cluster with probability proportional to its size
+        step_flops = sum(size * estimate[2] for size, estimate in zip(cluster_sizes, estimates)) / sum(cluster_sizes)
+        plan.update(state=state + graph, peak=state + graph + temporaries, step_flops=step_flops,
+                    construction_flops=sum(estimate[3] for estimate in estimates), description=description)
+    else:
+        raise Exception("Planning for algorithm {} not implemented! Try {}".format(
+            algorithm_name, ", ".join(["dummy", "linucb", "linucbsin", "linucbdiag", "linucbfd", "goblin", "goblinmf",
+                                        "macro", "block"])))
+    return plan
+
+
+def format_plan(plan):
+    return "{} ({}): state {}, peak {} per process over {} process(es), {:.3g} flops per step, " \
+           "{:.3g} flops to construct".format(plan["algorithm"], plan["description"], format_bytes(plan["state"]),
+                                              format_bytes(plan["peak"]), plan["processes"], plan["step_flops"],
+                                              plan["construction_flops"])
+
+
+def dataset_shape(dataset_location, num_clusters=None):
+    """
+    :return: number of users, cluster sizes (None without num_clusters), number of contexts offered per step
+    """
+    if dataset_location == "4cliques":
+        return FOUR_CLIQUES_USERS, None, load.FourCliquesContextManager.PROVIDED_CONTEXTS
+    import graph_io
+    num_users = graph_io.read_num_nodes(dataset_location)
+    cluster_sizes = None
+    if num_clusters:
+        cluster_to_idx, _ = load.load_clusters(dataset_location, num_clusters)
+        cluster_sizes = [len(users) for users in cluster_to_idx.values()]
+    return num_users, cluster_sizes, 25
+
+
+def dataset_edges(dataset_location):
+    """
+    :return: number of nonzero entries of the adjacency matrix of a dataset
+    """
+    if dataset_location == "4cliques":
+        # the cliques, before graph noise
+        return FOUR_CLIQUES_USERS * load.FourCliquesContextManager.CLIQUE_SIZE
+    import graph_io
+    return graph_io.load_sparse_graph(dataset_location)[0].nnz
+
+
+def plan_agent(algorithm_name, dataset_location, num_features, num_clusters=None, num_workers=None,
+               memory_budget=None, max_memory=None, sketch_rank=load.SKETCH_RANK, num_steps=10000,
+               dtype=numpy.float32):
+    """
+    Prints the plan of an agent, and raises an exception listing the alternatives that fit if its peak memory
+    exceeds max_memory (physical memory if None)
+    :return: plan, see estimate_agent
+    """
+    if algorithm_name not in load.AGENTS:
+        # load_agent will list the algorithms there are
+        return None
+    max_memory = max_memory or physical_memory()
+    num_users, cluster_sizes, num_contexts = dataset_shape(dataset_location, num_clusters)
+    if algorithm_name in ["block", "macro"] and not cluster_sizes:
+        # the agent itself will complain about the missing cluster data
+        return None
+    num_edges = dataset_edges(dataset_location) if algorithm_name == "goblinmf" else None
+    plan = estimate_agent(algorithm_name, num_users, num_features, cluster_sizes, num_contexts, num_workers,
+                          memory_budget, sketch_rank, num_steps, num_edges, dtype)
+    print("Plan: " + format_plan(plan))
+    if max_memory is None or plan["peak"] <= max_memory:
+        return plan
+
+    suggestions = []
+    if algorithm_name == "goblin" and dataset_location != "4cliques":
+        for clusters in load.CLUSTER_COUNTS:
+            alternative = estimate_agent("block", num_users, num_features, dataset_shape(dataset_location, clusters)[1],
+                                         num_contexts, dtype=dtype)
+            if alternative["peak"] <= max_memory:
+                suggestions.append("-a block -c {} ({})".format(clusters, format_bytes(alternative["peak"])))
+                break
+    if algorithm_name == "block":
+        for clusters in [c for c in load.CLUSTER_COUNTS if c > num_clusters]:
+            alternative = estimate_agent("block", num_users, num_features, dataset_shape(dataset_location, clusters)[1],
+                                         num_contexts, num_workers, memory_budget, dtype=dtype)
+            if alternative["peak"] <= max_memory:
+                suggestions.append("-c {} ({})".format(clusters, format_bytes(alternative["peak"])))
+                break
+        # spill cold clusters, leaving room for the graph and the temporaries of an update of the largest cluster
+        largest_state, largest_step = _cluster_estimate(max(cluster_sizes), num_features, num_contexts, False,
+                                                        numpy.dtype(dtype).itemsize)[:2]
+        budget = max_memory - num_users ** 2 * numpy.dtype(dtype).itemsize - largest_step
+        if budget >= largest_state:
+            alternative = estimate_agent("block", num_users, num_features, cluster_sizes, num_contexts, num_workers,
+                                         budget, dtype=dtype)
+            if alternative["peak"] <= max_memory:
+                suggestions.append("--memory-budget {} ({})".format(int(budget / 2 ** 20),
+                                                                    format_bytes(alternative["peak"])))
+    if algorithm_name in ["goblin", "block"]:
+        suggestions.append("-a goblinmf ({})".format(format_bytes(
+            estimate_agent("goblinmf", num_users, num_features, num_contexts=num_contexts, num_steps=num_steps,
+                           num_edges=dataset_edges(dataset_location), dtype=dtype)["peak"])))
+        suggestions.append("-a linucb ({})".format(format_bytes(
+            estimate_agent("linucb", num_users, num_features, num_contexts=num_contexts, dtype=dtype)["peak"])))
+    if algorithm_name in ["goblin", "block", "linucb"]:
+        suggestions.append("-a linucbfd ({})".format(format_bytes(
+            estimate_agent("linucbfd", num_users, num_features, num_contexts=num_contexts,
+                           sketch_rank=sketch_rank, num_steps=num_steps, dtype=dtype)["peak"])))
+    if numpy.dtype(dtype) != numpy.float32:
+        alternative = estimate_agent(algorithm_name, num_users, num_features, cluster_sizes, num_contexts, num_workers,
+                                     memory_budget, sketch_rank, num_steps, num_edges, numpy.float32)
+        if alternative["peak"] <= max_memory:
+            suggestions.append("--dtype float32 ({})".format(format_bytes(alternative["peak"])))
+    raise Exception("Plan exceeds the memory limit of {}! Try {}".format(format_bytes(max_memory),
+                                                                          ", ".join(suggestions)))
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.linalg.blas import get_blas_funcs
+
+'''
+In-place rank-1 updates of large dense matrices, for the Sherman-Morrison step of the agents.
+The matrix is split into blocks of rows, and every block is updated by BLAS ger on a thread pool.
+ger releases the GIL, so the blocks are updated in parallel and no temporary of the size of the matrix is made.
+While the pool runs, BLAS is limited to one thread (threadpoolctl, a dependency of scikit-learn), so that the
+pool's threads do not each start as many BLAS threads as there are cores.
+'''
+
+BLOCK_ROWS = 1024  # rows per block, matrices with fewer rows are updated in a single call
+NUM_THREADS = os.cpu_count() or 1
+_pool = None
+_blas_controller = None
+
+
+def _thread_pool():
+    global _pool, _blas_controller
+    if _pool is None:
+        from threadpoolctl import ThreadpoolController
+        _pool = ThreadPoolExecutor(max_workers=NUM_THREADS, thread_name_prefix="rank_one_update")
+        _blas_controller = ThreadpoolController()
+    return _pool
+
+
+def rank_one_update(matrix, u, v=None, scale=1.0, block_rows=BLOCK_ROWS):
+    """
+    matrix += scale * u v^T, in place. v is u if None.
+    :param matrix: C-contiguous square float32 or float64 matrix (a memory-mapped one is updated on disk)
+    """
+    # ger only updates a Fortran-ordered matrix of its own dtype in place, and returns a copy for any other, which
+    # would leave matrix unchanged
+    if not matrix.flags.c_contiguous or not matrix.flags.writeable or matrix.dtype not in (np.float32, np.float64):
+        raise Exception("Rank one update of a {} {} matrix not implemented! Try a writable C-contiguous float32 or "
+                        "float64 matrix".format("C-contiguous" if matrix.flags.c_contiguous else "non C-contiguous",
+                                                matrix.dtype))
+    v = u if v is None else v
+    u = np.asarray(u, dtype=matrix.dtype)
+    v = np.asarray(v, dtype=matrix.dtype)
+    ger = get_blas_funcs("ger", (matrix,))
+
+    def update_rows(start):
+        end = min(start + block_rows, matrix.shape[0])
+        # the transpose of a block of rows of a C-contiguous matrix is Fortran-contiguous, as BLAS expects, and
+        # holds v u^T for the block
+        ger(scale, v, u[start:end], a=matrix[start:end].T, overwrite_a=True)
+
+    starts = range(0, matrix.shape[0], block_rows)
+    if len(starts) == 1 or NUM_THREADS == 1:
+        for start in starts:
+            update_rows(start)
+    else:
+        pool = _thread_pool()
+        with _blas_controller.limit(limits=1, user_api="blas"):
+            list(pool.map(update_rows, starts))
+    return matrix
+
+
+def sherman_morrison_update(m_inverse, phi, block_rows=BLOCK_ROWS):
+    """
+    Updates the inverse of a symmetric matrix m in place to the inverse of m + phi phi^T:
+    m_inverse -= (m_inverse phi)(m_inverse phi)^T / (1 + phi^T m_inverse phi)
+    see https://en.wikipedia.org/wiki/Sherman%E2%80%93Morrison_formula
+    """
+    u = m_inverse.dot(phi)
+    denominator = 1 + float(np.dot(phi, u))
+    return rank_one_update(m_inverse, u, scale=-1 / denominator, block_rows=block_rows)
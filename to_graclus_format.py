@@ -1,4 +1,7 @@
 import sys
+import getopt
+import numpy as np
+import graph_io
 '''
 
 the matrix representation is
@@ -10,35 +13,47 @@ the matrix representation is
  3 5		.
  2 3 4	     	<--- nodes adjacent to 5
 
+with edge weights (--weighted) the header gains a format flag, and every
+adjacent node is followed by the weight of the edge:
 
+ 5 6 1
+ 2 4 3 1	<--- node 2 with weight 4, node 3 with weight 1
+ ...
 
-
+The graph is read from graph_edges.csv, graph.npz or graph.csv (see graph_io),
+and the output is written chunk_size rows at a time.
 '''
 
 
-def process_for_graclus(directory):
-    rows = []
-    with open(directory + "/graph.csv", "r") as infile:
-        for line in infile:
-            row = [int(item) for item in line.split(',')]
-            rows.append(row)
-    num_nodes = len(rows)
-    num_edges = sum(sum(row) for row in rows) / 2
+def process_for_graclus(directory, weighted=False, chunk_size=graph_io.CHUNK_SIZE):
+    graph, num_nodes = graph_io.load_sparse_graph(directory, weighted=weighted, chunk_size=chunk_size)
+    num_edges = graph.nnz // 2
+    if weighted:
+        # graclus only accepts positive integer weights
+        graph.data = np.maximum(np.rint(graph.data), 1)
 
     with open(directory + "/clustered_graph", "w") as outfile:
-        outfile.write("{} {}\n".format(num_nodes, num_edges))
-
-        for row_id, row in enumerate(rows):
-            row_graclus_1idx = row_id + 1
-            adjacent_items = []
-            for i, item in enumerate(row):
-                if item != 0:
-                    item_graclus_1idx = i + 1 #  graclus 1-indexes instead of zero-indexing. Annoying
-                    adjacent_items.append(str(item_graclus_1idx))
-            outfile.write(" ".join(adjacent_items) + "\n")
-
-                
+        if weighted:
+            outfile.write("{} {} 1\n".format(num_nodes, num_edges))
+        else:
+            outfile.write("{} {}\n".format(num_nodes, num_edges))
+
+        for chunk_start in range(0, num_nodes, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, num_nodes)
+            lines = []
+            for row_id in range(chunk_start, chunk_end):
+                row_start, row_end = graph.indptr[row_id], graph.indptr[row_id + 1]
+                adjacent_items = graph.indices[row_start:row_end] + 1  # graclus 1-indexes instead of zero-indexing. Annoying
+                if weighted:
+                    weights = graph.data[row_start:row_end].astype(np.int64)
+                    lines.append(" ".join("{} {}".format(item, weight) for item, weight in zip(adjacent_items, weights)))
+                else:
+                    lines.append(" ".join(map(str, adjacent_items)))
+            outfile.write("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":
-    process_for_graclus(sys.argv[1])
+    options, arguments = getopt.getopt(sys.argv[1:], "", ['weighted', 'chunk-size='])
+    options = dict(options)
+    process_for_graclus(arguments[0], weighted='--weighted' in options,
+                        chunk_size=int(options.get('--chunk-size', graph_io.CHUNK_SIZE)))